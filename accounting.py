@@ -0,0 +1,164 @@
+import argparse
+import contextlib
+import json
+import threading
+import time
+from collections import defaultdict
+
+# Prices in dollars per 1K tokens, used for the cost column of the reports
+PROMPT_PRICE = 0.0015
+COMPLETION_PRICE = 0.002
+
+_lock = threading.Lock()
+_local = threading.local()
+_usage_file = None
+
+def configure(usage_path: str):
+    """
+    Start appending usage records to usage_path as JSON lines
+    """
+    global _usage_file
+    _usage_file = open(usage_path, "a")
+
+def shutdown():
+    global _usage_file
+    if _usage_file is not None:
+        _usage_file.close()
+        _usage_file = None
+
+def current_scope() -> dict:
+    return getattr(_local, "scope", {})
+
+@contextlib.contextmanager
+def attribute(**scope):
+    """
+    Attribute the LLM calls made inside the block, e.g. `with accounting.attribute(node=node_id):`.
+    Scopes nest, so a node inside a document keeps the document attribute.
+    """
+    previous = current_scope()
+    _local.scope = {**previous, **scope}
+    try:
+        yield
+    finally:
+        _local.scope = previous
+
+def write(entry: dict):
+    if _usage_file is None:
+        return
+    line = json.dumps(entry) + "\n"
+    with _lock:
+        _usage_file.write(line)
+        _usage_file.flush()
+
+def record(usage: dict, latency: float):
+    """
+    Record the token usage and latency of one LLM call under the current scope
+    """
+    if _usage_file is None:
+        return
+    write({
+        "type": "llm",
+        "time": time.time(),
+        **current_scope(),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "cached_tokens": usage.get("cached_tokens", 0),
+        "latency": latency,
+    })
+
+def record_answer(hops: int):
+    """
+    Mark the end of a chat question that took the given number of LLM calls
+    """
+    if _usage_file is None:
+        return
+    write({"type": "answer", "time": time.time(), **current_scope(), "hops": hops})
+
+def load(usage_path: str) -> list:
+    with open(usage_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def cost(prompt_tokens: float, completion_tokens: float) -> float:
+    return (prompt_tokens * PROMPT_PRICE + completion_tokens * COMPLETION_PRICE) / 1000
+
+def new_totals() -> dict:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency": 0.0}
+
+def add_entry(totals: dict, entry: dict):
+    totals["calls"] += 1
+    totals["prompt_tokens"] += entry["prompt_tokens"]
+    totals["completion_tokens"] += entry["completion_tokens"]
+    totals["cached_tokens"] += entry.get("cached_tokens", 0)
+    totals["latency"] += entry["latency"]
+
+def node_report(entries: list) -> dict:
+    """
+    Totals per node and per subtree. Subtrees are found through the dotted node ids,
+    so the calls made for "doc.2.1" also count towards "doc.2" and "doc".
+    """
+    nodes = defaultdict(new_totals)
+    subtrees = defaultdict(new_totals)
+    for entry in entries:
+        if entry["type"] != "llm" or "node" not in entry:
+            continue
+        add_entry(nodes[entry["node"]], entry)
+        parts = entry["node"].split(".")
+        for i in range(1, len(parts) + 1):
+            add_entry(subtrees[".".join(parts[:i])], entry)
+    return {"nodes": dict(nodes), "subtrees": dict(subtrees)}
+
+def session_report(entries: list) -> dict:
+    """
+    Totals per chat session, with the number of answers and the average number of LLM calls per answer
+    """
+    sessions = defaultdict(lambda: {**new_totals(), "answers": 0, "hops": 0})
+    for entry in entries:
+        if "session" not in entry:
+            continue
+        session = sessions[entry["session"]]
+        if entry["type"] == "llm":
+            add_entry(session, entry)
+        elif entry["type"] == "answer":
+            session["answers"] += 1
+            session["hops"] += entry["hops"]
+    for session in sessions.values():
+        session["hops_per_answer"] = session["hops"] / session["answers"] if session["answers"] else 0
+    return dict(sessions)
+
+def print_table(title: str, rows: dict, top: int, columns: list):
+    print(title)
+    print(f"{'':<40}" + "".join(f"{column:>18}" for column in columns + ["cost"]))
+    ranked = sorted(rows.items(), key=lambda item: -cost(item[1]["prompt_tokens"], item[1]["completion_tokens"]))
+    for key, totals in ranked[:top]:
+        values = "".join(f"{totals[column]:>18.3f}" if isinstance(totals[column], float) else f"{totals[column]:>18}" for column in columns)
+        print(f"{key:<40}{values}{cost(totals['prompt_tokens'], totals['completion_tokens']):>18.4f}")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM usage recorded with --usage")
+    parser.add_argument("usage", type=str, help="The usage JSON lines file")
+    parser.add_argument("-b", "--by", choices=["node", "subtree", "session", "all"], default="all", help="How to group the usage")
+    parser.add_argument("-n", "--top", type=int, default=10, help="Number of rows to show")
+    parser.add_argument("-j", "--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    entries = load(args.usage)
+    report = {**node_report(entries), "sessions": session_report(entries)}
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    columns = ["calls", "prompt_tokens", "cached_tokens", "completion_tokens", "latency"]
+    if args.by in ["node", "all"]:
+        print_table("Most expensive nodes", report["nodes"], args.top, columns)
+    if args.by in ["subtree", "all"]:
+        print_table("Most expensive subtrees", report["subtrees"], args.top, columns)
+    if args.by in ["session", "all"]:
+        print_table("Chat sessions", report["sessions"], args.top, columns + ["answers", "hops_per_answer"])
+    llm_entries = [entry for entry in entries if entry["type"] == "llm"]
+    prompt_tokens = sum(entry["prompt_tokens"] for entry in llm_entries)
+    completion_tokens = sum(entry["completion_tokens"] for entry in llm_entries)
+    cached_tokens = sum(entry.get("cached_tokens", 0) for entry in llm_entries)
+    print(f"Total: {len(llm_entries)} calls, {prompt_tokens} prompt tokens ({cached_tokens} cached), {completion_tokens} completion tokens, ${cost(prompt_tokens, completion_tokens):.4f}")
+
+if __name__ == "__main__":
+    main()
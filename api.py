@@ -1,10 +1,17 @@
-import openai
+import hashlib
+import time
+import accounting
+import metrics
+import transcript
+from check_token import estimate_tokens
 from typing import List
 
 class Message:
-    def __init__(self, role, content):
+    def __init__(self, role, content, usage=None):
         self.role = role
         self.content = content
+        # Token usage of the completion that produced this message, if it came from a backend
+        self.usage = usage
     
     def to_dict(self):
         return {
@@ -12,11 +19,102 @@ class Message:
             "content": self.content
         }
 
+MODEL = "gpt-3.5-turbo"
+
+# Optional callable that replaces the OpenAI API, e.g. fake_llm.FakeLLM for benchmarks
+_backend = None
+_temperature = 0.9
+
+def set_backend(backend) -> None:
+    """
+    Route send_messages to backend(messages) -> Message instead of the OpenAI API. Pass None to restore the API.
+    """
+    global _backend
+    _backend = backend
+
+def set_temperature(temperature: float) -> None:
+    """
+    Sampling temperature of the API calls, 0 makes reruns as reproducible as the API allows
+    """
+    global _temperature
+    _temperature = temperature
+
+def request_key(messages: List[Message]) -> str:
+    """
+    Transcript key of a request: the messages, and the backend, model and temperature that answer them.
+    A backend with settings that change its replies describes them with a key() method.
+    """
+    if _backend is None:
+        backend = f"{MODEL}@{_temperature}"
+    elif hasattr(_backend, "key"):
+        backend = _backend.key()
+    else:
+        backend = type(_backend).__name__
+    return hashlib.sha256((backend + "\0" + prefix_hashes(messages)[-1]).encode("utf-8")).hexdigest()
+
 def send_messages(messages: List[Message]) -> Message:
-    completion = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[message.to_dict() for message in messages],
-        temperature=0.9
-    )
-    response_message = Message(completion['choices'][0]['message']['role'],completion['choices'][0]['message']['content'])
-    return response_message
\ No newline at end of file
+    metrics.incr("llm_calls")
+    start = time.perf_counter()
+    with metrics.span("llm_call", messages=len(messages)) as span:
+        key = request_key(messages) if transcript.enabled() else None
+        recorded = transcript.lookup(key) if key is not None else None
+        if recorded is not None:
+            metrics.incr("transcript_replays")
+            response_message = Message(recorded["role"], recorded["content"], dict(recorded["usage"]))
+        else:
+            if _backend is not None:
+                response_message = _backend(messages)
+            else:
+                response_message = create_completion(messages)
+            if response_message.usage is None:
+                response_message.usage = estimate_usage(messages, response_message)
+            if key is not None:
+                transcript.record(key, response_message.role, response_message.content, response_message.usage)
+        span.set(**response_message.usage)
+    latency = time.perf_counter() - start
+    metrics.incr("prompt_tokens", response_message.usage["prompt_tokens"])
+    metrics.incr("completion_tokens", response_message.usage["completion_tokens"])
+    metrics.incr("cached_tokens", response_message.usage.get("cached_tokens", 0))
+    accounting.record(response_message.usage, latency)
+    return response_message
+
+def create_completion(messages: List[Message]) -> Message:
+    # Imported on the first call, runs that use a fake backend never load the client
+    import openai
+    try:
+        completion = openai.ChatCompletion.create(
+            model=MODEL,
+            messages=[message.to_dict() for message in messages],
+            temperature=_temperature
+        )
+    except Exception:
+        metrics.incr("llm_errors")
+        raise
+    usage = completion.get('usage', {})
+    # Prompt tokens served from the provider's prompt cache, reported when a prefix of the prompt was reused
+    cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+    usage = {"prompt_tokens": usage.get('prompt_tokens', 0), "completion_tokens": usage.get('completion_tokens', 0), "cached_tokens": cached_tokens}
+    response_message = Message(completion['choices'][0]['message']['role'],completion['choices'][0]['message']['content'], usage)
+    return response_message
+
+def estimate_usage(messages: List[Message], response_message: Message) -> dict:
+    """
+    Approximate token usage for backends that do not report it
+    """
+    return {
+        "prompt_tokens": sum(estimate_tokens(message.content) for message in messages),
+        "completion_tokens": estimate_tokens(response_message.content),
+        "estimated": True,
+    }
+
+def prefix_hashes(messages: List[Message]) -> List[str]:
+    """
+    Hashes of messages[:1], messages[:2], ..., so that two prompts share a cacheable prefix
+    exactly when they share leading hashes
+    """
+    digest = hashlib.sha256()
+    hashes = []
+    for message in messages:
+        digest.update(message.role.encode("utf-8") + b"\0" + message.content.encode("utf-8", "surrogatepass") + b"\0")
+        hashes.append(digest.copy().hexdigest())
+    return hashes
@@ -1,12 +1,13 @@
 import streamlit as st
 import json
-import clipboard
-from chat import ContextChatBot, SYSTEM_PROMPT
-from encoder import ContextNode, load_unstructured, extract_text_from_pdf
-import os
+from chat import ContextChatBot
+from encoder import ContextNode
+from forest import DocumentForest
+from jobs import JobQueue
+import time
 
 # Create an instance of the chatbot
-chatbot = ContextChatBot(ContextNode("root"))
+chatbot = ContextChatBot(DocumentForest())
 
 # Create a title and a subtitle
 encoder_tab, context_tree_tab, chat_tab, history_tab = st.tabs(["Customize Encoder","Context Tree", "Chat", "History"])
@@ -16,29 +17,34 @@ def handle_json(file):
     data = json.load(file)
     return ContextNode.from_dict(data)
 
-def handle_nonjson(file):
-    if file.type == "text/plain":
-        # copy txt to a temporary file
-        file_name = file.name
-        with open(file_name, "w") as f:
-            f.write(file.getvalue().decode("utf-8"))
-        root_node = load_unstructured(file_name)
-    else:  # assume file is a PDF
-        # copy pdf to a temporary file
-        file_name = file.name
-        with open(file_name, "wb") as f:
-            f.write(file.getbuffer())
-        root_node = load_unstructured(file_name)
-    root_node.apply_word_limit()
-    root_node.generate_summary(True, title=True)
-    # delete temporary file
-    os.remove(file_name)
+@st.cache_resource
+def get_job_queue():
+    # One queue per server process, shared by all sessions and reruns
+    return JobQueue()
+
+job_queue = get_job_queue()
 
-    # save the root node to a json file
-    with open(file_name + ".json", "w") as f:
-        f.write(root_node.to_json())
+pending_jobs = []
 
-    return root_node
+def handle_nonjson(file):
+    """
+    Queue the file for encoding and return its tree once the job is done. Uploading the same file again
+    reuses the job and its cached result.
+    """
+    job_id = job_queue.submit(file.name, file.getvalue())
+    job = job_queue.get(job_id)
+    if job["status"] == "done":
+        return job_queue.load_result(job_id)
+    if job["status"] == "failed":
+        st.error(f"Encoding {file.name} failed: {job['error']}")
+        if st.button("Retry", key=f"retry_{job_id}"):
+            job_queue.submit(file.name, file.getvalue(), retry=True)
+            pending_jobs.append(job_id)
+        return None
+    progress = job["nodes_done"] / job["nodes_total"] if job["nodes_total"] else 0.0
+    st.progress(progress, text=f"Encoding {file.name}: {job['nodes_done']}/{job['nodes_total']} nodes summarized")
+    pending_jobs.append(job_id)
+    return None
 
 with st.sidebar:
     files = st.file_uploader("Upload files", type=["json", "pdf", "txt"], accept_multiple_files=True)
@@ -46,16 +52,16 @@ with st.sidebar:
         for file in files:
             if file.type == "application/json":
                 node = handle_json(file)
-            elif file.type == "text/plain":
-                node = handle_nonjson(file)
-            else:  # assume file is a PDF
+            else:  # a text or PDF file
                 node = handle_nonjson(file)
+            if node is None:
+                continue
             
             if len(files) == 1:
                 chatbot.root_node = node
                 chatbot.root_node.node_id = "root"
             else:
-                chatbot.root_node.add_child(node)
+                chatbot.root_node.add(node)
                 
 with encoder_tab:
     # Allow user to change root node id and title
@@ -84,7 +90,7 @@ with chat_tab:
     user_input = st.text_area("Question", "", height=200)
     submit = st.button("Ask Chatbot")
     if user_input.strip() != "" and submit:
-        chatbot.current_contexts = chatbot.root_node.get_context(1)
+        chatbot.current_contexts = chatbot.root_node.render_context(1)
         answer, reasoning, references = chatbot.ask(user_input)
         history.append(f"**Question:**\n\n{user_input}")
         history.append(f"**Answer:**\n\n{answer}")
@@ -105,3 +111,8 @@ with chat_tab:
 with history_tab:
     for message in history:
         st.markdown(message)
+
+# Poll the job queue until the uploaded files are encoded
+if pending_jobs:
+    time.sleep(2)
+    st.rerun()
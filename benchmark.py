@@ -0,0 +1,233 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import accounting
+import metrics
+from api import set_backend
+from chat import ContextChatBot
+from context_tree import ContextNode
+from encoder import load_unstructured, parse_by_page, parse_paper
+from fake_llm import FakeLLM
+
+SAMPLE_TREES = ["security.json", "jeff.txt.json", "genai_autism.pdf.json", "multid_hai.pdf.json"]
+IMPORT_MODULES = ["chat", "encoder", "doc_store", "jobs"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "da", "fe", "gi", "ho", "ju"]
+
+class Benchmark:
+    """
+    Collects timing results as flat records so that runs of different versions can be compared.
+    """
+    def __init__(self, repeat: int = 5, samples: int = 200, seed: int = 0, fan_out: bool = False):
+        self.repeat = repeat
+        self.fan_out = fan_out
+        self.samples = samples
+        self.random = random.Random(seed)
+        self.results = []
+
+    def record(self, corpus: str, metric: str, value: float, unit: str):
+        self.results.append({"corpus": corpus, "metric": metric, "value": value, "unit": unit})
+        print(f"{corpus:>24} {metric:<28} {value:>14.6f} {unit}")
+
+    def measure(self, corpus: str, metric: str, func, repeat: int = 0, per: int = 1):
+        """
+        Record the median wall-clock time of func over repeat runs, divided by the number of
+        operations per run, and return its last result
+        """
+        timings = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = func()
+            timings.append(time.perf_counter() - start)
+        self.record(corpus, metric, statistics.median(timings) / per, "s")
+        return result
+
+    def sample(self, items: list) -> list:
+        if len(items) <= self.samples:
+            return items
+        return self.random.sample(items, self.samples)
+
+    def run_tree(self, corpus: str, json_string: str, backend: FakeLLM, questions: int):
+        """
+        Tree load, lookup, context rendering and chat navigation on an encoded tree
+        """
+        root_node = self.measure(corpus, "tree_load", lambda: ContextNode.from_json(json_string))
+        self.measure(corpus, "tree_dump", lambda: root_node.to_json())
+        nodes = []
+        stack = [root_node]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack += node.children
+        self.record(corpus, "node_count", len(nodes), "nodes")
+        self.record(corpus, "tree_memory_per_node", root_node.store.memory_usage() / len(nodes), "bytes")
+
+        sampled = self.sample(nodes)
+        self.measure(corpus, "get_node", lambda: [root_node.get_node(node.node_id) for node in sampled], per=len(sampled))
+        self.measure(corpus, "get_context_root", lambda: root_node.get_context(1))
+        fresh_root = ContextNode.from_json(json_string)
+        context = self.measure(corpus, "render_context_root_cold", lambda: fresh_root.render_context(1), repeat=1)
+        self.measure(corpus, "render_context_root", lambda: root_node.render_context(1))
+        self.record(corpus, "root_context_size", len(context), "chars")
+        self.measure(corpus, "get_context_node", lambda: [node.get_context(1, True) for node in sampled], per=len(sampled))
+        self.measure(corpus, "render_context_node", lambda: [node.render_context(1, True) for node in sampled], per=len(sampled))
+
+        leaves = [node for node in nodes if len(node.children) == 0 and node.title.strip() != ""]
+        if questions <= 0 or len(leaves) == 0:
+            return
+        chatbot = ContextChatBot(root_node, fan_out=self.fan_out)
+        hops = []
+        latencies = []
+        for leaf in self.random.sample(leaves, min(questions, len(leaves))):
+            calls = backend.calls
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                chatbot.ask(f"What does the document say about {leaf.title}?")
+            latencies.append(time.perf_counter() - start)
+            hops.append(backend.calls - calls)
+            chatbot.reset_history()
+        self.record(corpus, "chat_latency", statistics.mean(latencies), "s")
+        self.record(corpus, "chat_hops", statistics.mean(hops), "calls")
+
+    def run_synthetic(self, scale: int, backend: FakeLLM, questions: int, chunk_words: int):
+        """
+        Chunking and summarization throughput on a generated corpus, followed by the tree benchmarks
+        """
+        corpus = f"synthetic_x{scale}"
+        root_node = make_synthetic_corpus(5 * scale, 10, 600, self.random.randint(0, 2**31))
+        sections = [section for doc_node in root_node.children for section in doc_node.children]
+        self.measure(corpus, "chunking", lambda: [section.apply_word_limit(chunk_words) for section in sections], repeat=1)
+        calls = backend.calls
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            root_node.generate_summary(True, "1/4", True)
+        elapsed = time.perf_counter() - start
+        self.record(corpus, "summarization", elapsed, "s")
+        self.record(corpus, "summarization_throughput", (backend.calls - calls) / elapsed, "nodes/s")
+        self.run_tree(corpus, root_node.to_json(), backend, questions)
+
+    def run_imports(self, module: str):
+        """
+        Cold import time of a module, measured in a fresh interpreter so that nothing is imported already
+        """
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        timings = []
+        for _ in range(self.repeat):
+            output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True).stdout
+            timings.append(float(output.split()[-1]))
+        self.record(module, "import_time", statistics.median(timings), "s")
+
+    def run_parse(self, file_path: str):
+        corpus = os.path.basename(file_path)
+        if file_path.endswith(".pdf"):
+            self.measure(corpus, "parse_by_page", lambda: parse_by_page(file_path), repeat=1)
+            self.measure(corpus, "parse_paper", lambda: parse_paper(file_path), repeat=1)
+        elif file_path.endswith(".txt"):
+            self.measure(corpus, "load_unstructured", lambda: load_unstructured(file_path), repeat=1)
+
+def make_synthetic_corpus(num_docs: int, num_sections: int, num_words: int, seed: int = 0) -> ContextNode:
+    """
+    Generate a two-level corpus of documents and sections filled with pseudo-words
+    """
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(2000)]
+    root_node = ContextNode("root", "Synthetic corpus")
+    for d in range(num_docs):
+        doc_node = ContextNode(f"doc{d + 1}", f"Document {d + 1}")
+        for s in range(num_sections):
+            title = " ".join(rng.choices(vocabulary, k=3))
+            content = " ".join(rng.choices(vocabulary, k=num_words))
+            doc_node.add_child(ContextNode(f"doc{d + 1}.{s + 1}", title, content))
+        root_node.add_child(doc_node)
+    return root_node
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """
+    Return the timing metrics that are slower than the baseline by more than the tolerance
+    """
+    with open(baseline_path, "r") as f:
+        baseline = {(r["corpus"], r["metric"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["corpus"], result["metric"]))
+        if previous is None or result["unit"] != "s" or previous["value"] <= 0:
+            continue
+        change = result["value"] / previous["value"] - 1
+        if change > tolerance:
+            regressions.append({**result, "baseline": previous["value"], "change": change})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encoding and chat with a fake LLM backend")
+    parser.add_argument("-t", "--trees", nargs="*", default=SAMPLE_TREES, help="Encoded JSON trees to benchmark")
+    parser.add_argument("-i", "--inputs", nargs="*", default=[], help="PDF or TXT files to benchmark the parsers on")
+    parser.add_argument("-m", "--imports", nargs="*", default=IMPORT_MODULES, help="Modules to measure the cold import time of")
+    parser.add_argument("-s", "--scales", nargs="*", type=int, default=[1, 10], help="Sizes of the synthetic corpora")
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Fake LLM latency per prompt token in seconds")
+    parser.add_argument("--fan-out", type=int, default=0, help="Let the fake LLM request this many nodes at once and answer them with parallel calls")
+    parser.add_argument("-q", "--questions", type=int, default=10, help="Number of chat questions per corpus")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of repetitions for timings")
+    parser.add_argument("--chunk-words", type=int, default=200, help="Word limit used for chunking synthetic corpora")
+    parser.add_argument("-o", "--output", type=str, default="benchmark.json", help="The output json file")
+    parser.add_argument("-c", "--compare", type=str, help="A previous output file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown relative to the compared file")
+    parser.add_argument("--trace", type=str, help="Also record timing spans and metrics to this JSON lines file")
+    parser.add_argument("--usage", type=str, help="Also record token usage per node and chat question to this JSON lines file")
+    args = parser.parse_args()
+    if args.trace is not None:
+        metrics.configure(args.trace)
+    if args.usage is not None:
+        accounting.configure(args.usage)
+
+    backend = FakeLLM(args.latency, args.latency_per_token, max_targets=max(1, args.fan_out))
+    set_backend(backend)
+    benchmark = Benchmark(args.repeat, fan_out=args.fan_out > 1)
+    for module in args.imports:
+        benchmark.run_imports(module)
+    for file_path in args.inputs:
+        benchmark.run_parse(file_path)
+    for tree_path in args.trees:
+        with open(tree_path, "r") as f:
+            json_string = f.read()
+        benchmark.run_tree(os.path.basename(tree_path), json_string, backend, args.questions)
+    for scale in args.scales:
+        benchmark.run_synthetic(scale, backend, args.questions, args.chunk_words)
+    set_backend(None)
+    metrics.shutdown()
+    accounting.shutdown()
+
+    output = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "latency_per_token": args.latency_per_token,
+            "fan_out": args.fan_out,
+        },
+        "results": benchmark.results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(benchmark.results, args.compare, args.tolerance)
+        for r in regressions:
+            print(f"Regression: {r['corpus']} {r['metric']} {r['baseline']:.6f}s -> {r['value']:.6f}s (+{r['change']:.0%})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
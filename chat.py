@@ -1,64 +1,54 @@
+import io
 import json
-import clipboard
 import argparse
 import os
-from encoder import ContextNode
-from api import Message, send_messages
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import accounting
+import locales
+import metrics
+import transcript
+from context_tree import ContextNode
+from doc_store import DocumentStore
+from forest import DocumentForest
+from api import Message, send_messages, set_temperature
+from structured_output import parse_structured, CHAT_SCHEMAS, MAP_SCHEMA
 from typing import Tuple, List
-
-SYSTEM_PROMPT = """
-As an AI, you provide answers to questions based on JSON-formatted documents. Follow these steps:
-1. User provides a JSON string of summarized document contexts.
-2. User asks a question or makes a statement. If you believe user is not seeking an answer about the document, behave like a normal chatbot, answer with response_type "answer".
-3. Consider the context and your own knowledge to generate a response. Don't just look for explicit answers, but also try to infer and reason based on the information given.
-4. For document-specific questions, locate the relevant part of the document. Guess one if you don't know where to look.
-5. If the summarized context is insufficient, request more details:
-   {"response_type": "request", "targets": [<node_ids>], "reasoning": "<reasoning>", "original": true/false}
-   Choose "original" based on whether you need the original or summarized version.
-   node_ids are a list of ids found in the context tree and not in the previous requests. You should never request for "root".
-   For reasoning, explain what the user needs, and why you need more details in the request targets, and how you will use the information.
-6. Once you have the necessary information, answer like this:
-   {"response_type": "answer", "content": "<answer>", "reasoning":"<reasoning>", "references": ["<node_id>", ...]}
-   For reasoning, explain how you used the information provided in the context to generate the answer.
-7. Use double quotes for keys and values in JSON strings. Reply only with JSON strings.
-8. If your cannot find the answer, and you believe that without more information, you should always try requesting for details first before asking user for clarification.
-
-Reminders:
-- NEVER request previously requested node_ids. If you can't find the answer, request a different node_id with "request" type, or ask for clarification with "answer" type.
-- Pay close attention to the context tree. A node may have completely different contexts from another node on the same level.
-- Pay close attention to the previous questions. The user may be asking questions based on previous conversations.
-- Answer with as many details as possible, unless otherwise specified.
-- Understand and interpret the content of the documents. Don't just look for explicit text matches but also consider information that's implied or can be inferred.
-- Use the context to its fullest extent, including making inferences and drawing conclusions based on the available information. This can include inferring the author's intentions, comparing and contrasting ideas, summarizing key points, or compose new contents, etc.
-- The answer may not be explicitly stated in the document. Use your knowledge and understanding to reason and generate a meaningful response.
-- Use bullet points or tables to list items, use **bold** to highlight important points, use *italics* to refer to specific terms.
-- User may interact you in a conversational manner. For example, they may give you suggestions on your previous responses, or ask you to clarify your previous responses.
-- If user wants you to be creative, you should utilize the context and generate a creative response. Don't just find answers in the context and repeat them.
-
-Example:
-Context: {...}
-Previous Requests: ["root", "doc.1", "doc.2"]
-Question: What is the threat model introduced in the paper?
-Assistant: {"response_type": "request", "targets": ["doc.3"], "reasoning": "User is asking for the threat model in the paper. doc.3 has title Threat Model, and is not in previous requests. I should be able to find details about the threat model in the original text in this node.", "original": true}
-
-Example:
-Context: {...}
-Previous Requests: ["root", "doc.1", "doc.2", "doc.3"]
-Question: What is the threat model introduced in the paper?
-Assistant: {"response_type": "answer", "content": "The threat model introduced in the paper is ...", "reasoning": "I found the answer in the original text in doc.3. I used the information provided in the context to generate the answer.", "references": ["doc.3"]}
-"""
+# SYSTEM_PROMPT used to be defined here and is still exported for existing callers, prompts are loaded through locales
+from prompts_en import SYSTEM_PROMPT
 
 class ContextChatBot:
     """
-    A chatbot that answers questions based on JSON-formatted contexts.
+    A chatbot that answers questions based on JSON-formatted contexts. Prompts come from the pack of a
+    fixed locale, or of the language detected in each question if locale is None.
     """
-    def __init__(self, root_node: ContextNode, curr_question: str = "", clipboard_mode: bool = False):
+    def __init__(self, root_node: ContextNode, curr_question: str = "", clipboard_mode: bool = False, fan_out: bool = False, max_workers: int = 4,
+                 max_hops: int = 8, max_tokens: int = None, max_seconds: float = None, locale: str = None):
         self.root_node = root_node
-        self.history = [Message("system", SYSTEM_PROMPT)]
+        self.locale = locale
+        self.pack = locales.get_pack(locale or locales.DEFAULT_LOCALE)
+        self.history = [Message("system", self.pack.SYSTEM_PROMPT)]
         self.curr_question = curr_question
-        self.current_contexts = str(self.root_node.get_context(1))
+        self.current_contexts = self.root_node.render_context(1)
         self.clipboard_mode = clipboard_mode
+        # Answer requests for several nodes with one concurrent call per node and a final merging call
+        self.fan_out = fan_out
+        self.max_workers = max_workers
         self.previous_requests = ["root"]
+        # Nodes whose contexts were sent to the model for the current question, and those requested but not sent yet
+        self.delivered = []
+        self.pending = []
+        # Limits per question on LLM calls, tokens and wall-clock time, None for no limit
+        self.max_hops = max_hops
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.session_id = uuid.uuid4().hex[:8]
+        self.question_number = 0
+        self.hops = 0
+        self.question_tokens = 0
+        self.question_start = time.perf_counter()
+        self.next_prompt = None
 
     def read_json_file(self, file_path: str):
         """
@@ -78,21 +68,58 @@ class ContextChatBot:
         """
         Reset the history to the initial state with only the system prompt.
         """
-        self.history = [Message("system", SYSTEM_PROMPT)]
+        self.history = [Message("system", self.pack.SYSTEM_PROMPT)]
+
+    def set_locale(self, locale: str):
+        """
+        Switch the prompt pack, the system prompt in the history follows
+        """
+        pack = locales.get_pack(locale)
+        if pack is not self.pack:
+            self.pack = pack
+            self.history[0] = Message("system", pack.SYSTEM_PROMPT)
 
     def ask(self, question: str, contexts: str = "") -> Tuple[str, str, List[str]]:
         """
-        Ask a question and return the response.
+        Ask a question and return the answer. Requests for more details are followed in a loop until the
+        model answers or the hop, token or time budget runs out.
         """
         self.curr_question = question
+        self.set_locale(self.locale or locales.detect_language(question))
         if contexts == "":
             contexts = self.current_contexts
-        user_message = self.prepare_user_message(question, contexts)
+        self.previous_requests = ["root"]
+        self.delivered = []
+        self.pending = []
+        self.hops = 0
+        self.question_tokens = 0
+        self.question_start = time.perf_counter()
+        while True:
+            exhausted = self.exhausted_budget()
+            if exhausted is not None:
+                return self.budget_answer(exhausted)
+            result = self.process_response(self.send(question, contexts, final=self.is_final_hop()))
+            if result is not None:
+                return result
+            # The model requested more details, follow them with the next prompt
+            question, contexts = self.next_prompt
 
+    def send(self, question: str, contexts: str, final: bool = False) -> str:
+        """
+        Send one prompt, or copy it to the clipboard and read the pasted reply, and return the response text.
+        On the final hop the model is told to answer, the note is not kept in the history.
+        """
+        user_message = self.prepare_user_message(self.pack.FINAL_HOP_NOTE + question if final else question, contexts)
         print(user_message.content)
+        if self.hops == 0:
+            self.question_number += 1
+        self.hops += 1
+        self.delivered += self.pending
+        self.pending = []
         if self.clipboard_mode:
             print("The message has been copied to your clipboard")
             # input("Press enter to continue")
+            import clipboard
             clipboard.copy(user_message.content)
             print("Please paste the AI response: Ctrl D to submit")
             response_content = ""
@@ -102,61 +129,127 @@ class ContextChatBot:
                 except EOFError:
                     break
                 response_content += line
-            response_content = response_content.strip()
-        else:
-            # input("Press enter to continue")
-            response_message = send_messages(self.history + [user_message])
-            self.history += [Message("user", f"Question: {question}\n")] + [response_message]
-            response_content = response_message.content
+            return response_content.strip()
+
+        # input("Press enter to continue")
+        metrics.incr("chat_hops")
+        with metrics.span("chat_hop", previous_requests=len(self.previous_requests)), \
+                accounting.attribute(session=self.session_id, question=self.question_number, hop=self.hops):
+            response_message = send_messages(self.build_messages(user_message))
+        self.add_usage(response_message)
+        self.history += [Message("user", f"{self.pack.QUESTION_LABEL}{question}\n")] + [response_message]
+        return response_message.content
 
-        return self.process_response(response_content)
+    def add_usage(self, message: Message):
+        if message.usage is not None:
+            self.question_tokens += message.usage.get("prompt_tokens", 0) + message.usage.get("completion_tokens", 0)
+
+    def exhausted_budget(self, calls: int = 1):
+        """
+        The name of the budget that would be exceeded by making this many more LLM calls for the current question, or None
+        """
+        if self.max_hops is not None and self.hops + calls > self.max_hops:
+            return "hop"
+        if self.max_tokens is not None and self.question_tokens >= self.max_tokens:
+            return "token"
+        if self.max_seconds is not None and time.perf_counter() - self.question_start >= self.max_seconds:
+            return "time"
+        return None
+
+    def is_final_hop(self) -> bool:
+        """
+        Whether the budgets leave room for this call only. The token and time a call takes are predicted from
+        the average of the calls so far, so the model gets a last turn to answer before those run out as well.
+        """
+        if self.max_hops is not None and self.hops + 1 >= self.max_hops:
+            return True
+        if self.hops == 0:
+            return False
+        if self.max_tokens is not None and self.question_tokens * (self.hops + 2) / self.hops > self.max_tokens:
+            return True
+        elapsed = time.perf_counter() - self.question_start
+        return self.max_seconds is not None and elapsed * (self.hops + 2) / self.hops > self.max_seconds
+
+    def budget_answer(self, budget: str) -> Tuple[str, str, List[str]]:
+        """
+        Stop navigating and answer with the nodes whose contexts the model has seen
+        """
+        metrics.incr("chat_budget_exhausted")
+        visited = list(self.delivered)
+        print(f"Stopped after {self.hops} LLM calls: the {budget} budget is exhausted")
+        answer = self.pack.BUDGET_ANSWER
+        if visited:
+            answer += self.pack.BUDGET_REFERENCES
+        reasoning = self.pack.BUDGET_REASONING.format(budget=budget, hops=self.hops, tokens=self.question_tokens)
+        self.end_question()
+        return answer, reasoning, visited
+
+    def build_messages(self, user_message: Message) -> List[Message]:
+        """
+        The system prompt and the root context, which are byte-identical on every call, followed by the history and the new message.
+        """
+        return [self.history[0], Message("system", self.pack.ROOT_CONTEXT_HEADER + self.current_contexts)] + self.history[1:] + [user_message]
 
     def prepare_user_message(self, question: str, contexts: str) -> Message:
         """
-        Construct a user message with the given question and contexts.
+        Construct a user message with the given question and contexts. The root context is referred to
+        instead of repeated, except in clipboard mode where the message is pasted on its own.
         """
-        question_prompt = f"Question: {question}\n"
-        context_prompt = f"Contexts: {contexts}\n"
-        previous_requests_prompt = f"Previous Requests: {self.previous_requests}\n"
-        json_reminder = "For request, your JSON string should contain the following keys: response_type, targets, reasoning, original.\
-            For answer, your JSON string should contain the following keys: response_type, content, reasoning, references.\n"
-        return Message("user", context_prompt + previous_requests_prompt + question_prompt + json_reminder)
+        prompt = io.StringIO()
+        prompt.write(self.pack.CONTEXTS_LABEL)
+        prompt.write(contexts if self.clipboard_mode or contexts != self.current_contexts else self.pack.ROOT_CONTEXT_NOTE)
+        prompt.write(f"\n{self.pack.PREVIOUS_REQUESTS_LABEL}{json.dumps(self.previous_requests)}\n")
+        prompt.write(f"{self.pack.QUESTION_LABEL}{question}\n")
+        prompt.write(self.pack.JSON_REMINDER)
+        return Message("user", prompt.getvalue())
 
     def process_response(self, response_content: str) -> Tuple[str, str, List[str]]:
         """
         Process the response and return the response content, reasoning, and references.
+        Returns None if the model requested more details, which are then in self.next_prompt.
         """
-        response_content = self.extract_json(response_content)
         print(f"Raw response: {response_content}")
 
-        response, is_json = self.load_json(response_content)
-        if not is_json:
-            return response_content, "", []
+        # A reply without any JSON is taken as a plain answer. Malformed JSON is repaired locally, or with one
+        # repair call if the budget allows it, instead of asking the question again.
+        if "{" not in response_content:
+            self.end_question()
+            return response_content.strip(), "", []
+        send = None if self.clipboard_mode or self.exhausted_budget() is not None else self.send_repair
+        response = parse_structured(response_content, CHAT_SCHEMAS, send=send)
+        if response is None:
+            # The raw reply is never shown as the answer
+            metrics.incr("chat_invalid_json")
+            self.end_question()
+            return self.pack.INVALID_ANSWER, self.pack.NO_REASONING, []
 
         if response['response_type'] == 'request':
-            for target in response['targets']:
-                if target in self.previous_requests:
-                    response['targets'].remove(target)
+            # Drop visited and repeated targets
+            response['targets'] = [target for target in dict.fromkeys(response['targets']) if target not in self.previous_requests]
             return self.handle_request_response(response)
-        elif response['response_type'] == 'answer':
-            self.previous_requests = ["root"]
-            return self.handle_answer_response(response)
-        else:
-            print("Invalid response type")
-            return response_content, "", []
-
-    # Additional helper methods
-    def extract_json(self, content: str):
-        start = content.find("{")
-        end = content.rfind("}")
-        return content[start:end+1]
-
-    def load_json(self, content: str):
-        try:
-            response = json.loads(content)
-            return response, True
-        except Exception as e:
-            return content, False
+        metrics.incr("chat_answers")
+        self.end_question()
+        return self.handle_answer_response(response)
+
+    def end_question(self):
+        """
+        Record how many LLM calls the current question took and start counting for the next one.
+        """
+        if self.hops > 0:
+            with accounting.attribute(session=self.session_id, question=self.question_number):
+                accounting.record_answer(self.hops)
+        self.hops = 0
+
+    def send_repair(self, messages: List[Message]) -> Message:
+        """
+        The repair call for a malformed reply, counted as a hop of the current question. Only made when
+        exhausted_budget allows one more call.
+        """
+        self.hops += 1
+        with accounting.attribute(session=self.session_id, question=self.question_number, hop=self.hops):
+            response_message = send_messages(messages)
+        self.add_usage(response_message)
+        return response_message
 
     def handle_request_response(self, response: dict):
         if len(self.history) >= 6:
@@ -166,32 +259,97 @@ class ContextChatBot:
         original = False
         if "original" in response.keys():
             original = response["original"]
+        if self.fan_out and not self.clipboard_mode:
+            nodes = self.get_nodes(node_ids)
+            # One call per node plus the merging call have to fit in the budget
+            if len(nodes) > 1 and self.exhausted_budget(len(nodes) + 1) is None:
+                self.previous_requests += response['targets']
+                self.delivered += [node.node_id for node in nodes]
+                return self.fan_out_request(nodes, response.get("reasoning", ""))
         nodes, contexts = self.get_nodes_and_contexts(node_ids, original)
 
         if nodes:
             self.history.append(Message("assistant", str(response)))
             self.previous_requests += response['targets']
-            return self.ask(self.curr_question, contexts)
+            # Delivered once the next prompt is sent
+            self.pending = [node.node_id for node in nodes]
+            self.next_prompt = (self.curr_question, contexts)
         else:
-            return self.ask("Request is invalid. Try to request for a valid id." + self.curr_question, self.current_contexts)
+            metrics.incr("chat_invalid_requests")
+            metrics.incr("llm_retries")
+            self.next_prompt = (self.pack.INVALID_REQUEST + self.curr_question, self.current_contexts)
+        return None
 
-    def get_nodes_and_contexts(self, node_ids: list, original: bool):
+    def get_nodes(self, node_ids: list):
         nodes = []
-        contexts = ""
         for node_id in node_ids:
             node = self.root_node.get_node(node_id)
             if node is None:
                 print("Invalid node_id")
                 continue
             nodes.append(node)
+        return nodes
 
+    def get_nodes_and_contexts(self, node_ids: list, original: bool):
+        nodes = self.get_nodes(node_ids)
+        contexts = io.StringIO()
+        for node in nodes:
             print(f"Getting contexts for node_id: {node.node_id}")
-            contexts += str(node.get_context(1, original)) + "\n"
-        return nodes, contexts
+            node.write_context(contexts, 1, original)
+            contexts.write("\n")
+        return nodes, contexts.getvalue()
+
+    def fan_out_request(self, nodes: list, focus: str) -> Tuple[str, str, List[str]]:
+        """
+        Ask the current question about each requested node's original content concurrently, then merge the partial answers in one call.
+        """
+        # The parallel calls count as separate LLM calls but share a hop number
+        scope = {**accounting.current_scope(), "session": self.session_id, "question": self.question_number, "hop": self.hops + 1}
+        self.hops += len(nodes)
+        with metrics.span("chat_fan_out", targets=len(nodes)):
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(nodes)))) as executor:
+                partials = list(executor.map(lambda node: self.map_node(node, self.curr_question, focus, scope), nodes))
+        self.question_tokens += sum(partial[3] for partial in partials)
+        relevant = [partial for partial in partials if partial[2]] or partials
+
+        prompt = io.StringIO()
+        prompt.write(f"{self.pack.QUESTION_LABEL}{self.curr_question}\n")
+        for node_id, content, _, _ in relevant:
+            prompt.write(f"{self.pack.PARTIAL_ANSWER_LABEL.format(node_id=node_id)}{content}\n")
+        user_message = Message("user", prompt.getvalue())
+        print(user_message.content)
+        self.hops += 1
+        metrics.incr("chat_hops")
+        with metrics.span("chat_reduce", partials=len(relevant)), \
+                accounting.attribute(session=self.session_id, question=self.question_number, hop=self.hops):
+            response_message = send_messages([Message("system", self.pack.REDUCE_PROMPT), user_message])
+        self.add_usage(response_message)
+        self.history += [Message("user", f"{self.pack.QUESTION_LABEL}{self.curr_question}\n"), response_message]
+        return self.process_response(response_message.content)
+
+    def map_node(self, node, question: str, focus: str, scope: dict):
+        """
+        Answer the question from one node. Runs in a worker thread, so the accounting scope is passed in.
+        Returns (node_id, partial answer, relevant, tokens used).
+        """
+        contexts = io.StringIO()
+        node.write_context(contexts, 1, True)
+        pack = self.pack
+        user_message = Message("user", f"{pack.SECTION_LABEL}{contexts.getvalue()}\n{pack.QUESTION_LABEL}{question}\n{pack.LOOK_FOR_LABEL}{focus}\n")
+        metrics.incr("chat_hops")
+        with metrics.span("chat_map", node=node.node_id), accounting.attribute(**scope, target=node.node_id):
+            response_message = send_messages([Message("system", pack.MAP_PROMPT), user_message])
+        usage = response_message.usage or {}
+        tokens = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        # Only local repairs here, a partial answer that cannot be parsed is passed on as text
+        response = parse_structured(response_message.content, MAP_SCHEMA)
+        if response is None:
+            return node.node_id, response_message.content.strip(), True, tokens
+        return node.node_id, response["content"], response.get("relevant", True), tokens
 
     def handle_answer_response(self, response: dict) -> Tuple[str, str, List[str]]:
-        answer = response['content'] if 'content' in response.keys() else "No content in response"
-        reasoning = response['reasoning'] if 'reasoning' in response.keys() else "No reasoning in response"
+        answer = response['content'] if 'content' in response.keys() else self.pack.NO_CONTENT
+        reasoning = response['reasoning'] if 'reasoning' in response.keys() else self.pack.NO_REASONING
         references = response.get('references', []) if 'references' in response.keys() else []
         return answer, reasoning, references
 
@@ -209,45 +367,79 @@ class ContextChatBot:
             print("Not enough history to regenerate response")
             return None
 
-def main():
+def main(locale: str = None):
     parser = argparse.ArgumentParser(description="Interact with ContextChatBot")
-    parser.add_argument('--read-json', '-r', nargs='+', required=True, help="Path to one or more JSON files with context data")
+    parser.add_argument('--read-json', '-r', nargs='+', default=[], help="Path to one or more JSON files with context data")
+    parser.add_argument('--db', type=str, help="A document database to chat with, JSON files given with --read-json are added to it")
+    parser.add_argument('--doc', nargs='+', help="Names of the database documents to chat with, all by default")
     parser.add_argument('--clipboard-mode', '-c', action='store_true', help="Enable clipboard mode")
+    parser.add_argument('--fan-out', action='store_true', help="Answer requests for several nodes with parallel per-node calls and a merging call")
+    parser.add_argument('--max-hops', type=int, default=8, help="Maximum number of LLM calls per question")
+    parser.add_argument('--max-tokens', type=int, help="Maximum number of prompt and completion tokens per question")
+    parser.add_argument('--max-seconds', type=float, help="Maximum time spent on a question before answering with what was found")
+    parser.add_argument('--locale', choices=list(locales.PACKS), default=locale, help="Language of the prompts, detected from each question by default")
+    parser.add_argument('--trace', type=str, help="Write timing spans and metrics to this JSON lines file")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this port")
+    parser.add_argument('--usage', type=str, help="Append token usage and latency per question and hop to this JSON lines file")
+    parser.add_argument('--transcript', type=str, help="Record LLM responses to this JSON lines file and serve them again for the same requests")
+    parser.add_argument('--transcript-mode', choices=transcript.MODES, default=transcript.AUTO, help="record, replay without calling the API, or auto")
+    parser.add_argument('--temperature', type=float, help="Sampling temperature of the API calls, 0.9 by default")
 
     args = parser.parse_args()
+    if args.trace is not None or args.metrics_port is not None:
+        metrics.configure(args.trace, args.metrics_port)
+    if args.usage is not None:
+        accounting.configure(args.usage)
+    if args.transcript is not None:
+        transcript.configure(args.transcript, args.transcript_mode)
+    if args.temperature is not None:
+        set_temperature(args.temperature)
 
-    root_node = ContextNode("root")
-    if len(args.read_json) == 1:
-        if not os.path.isfile(args.read_json[0]):
-            print(f"Error: File {args.read_json[0]} does not exist.")
+    if args.db is None and not args.read_json:
+        parser.error("one of --read-json or --db is required")
+    for json_file in args.read_json:
+        if not os.path.isfile(json_file):
+            print(f"Error: File {json_file} does not exist.")
             return
-        if not is_valid_json(args.read_json[0]):
-            print(f"Error: {args.read_json[0]} is not a valid JSON file.")
+        if not is_valid_json(json_file):
+            print(f"Error: {json_file} is not a valid JSON file.")
             return
+
+    if args.db is not None:
+        store = DocumentStore(args.db)
+        names = list(args.doc or [])
+        for json_file in args.read_json:
+            with open(json_file, "r") as f:
+                json_string = f.read()
+            name = os.path.basename(json_file).split(".")[0]
+            store.add_document(ContextNode.from_json(json_string), name)
+            names.append(name)
+        library = store.library(names)
+        print(f"Documents loaded from {args.db}: {names or [doc['name'] for doc in store.list_documents()]}")
+        # Like a single JSON file, a single document is used as the root itself
+        root_node = next(iter(library.documents.values())) if len(library) == 1 else library
+    elif len(args.read_json) == 1:
         with open(args.read_json[0], "r") as f:
             json_string = f.read()
         root_node = ContextNode.from_json(json_string)
+        print(f"Context data loaded:\n{str(root_node.to_dict())}")
     else:
+        root_node = DocumentForest()
         for json_file in args.read_json:
-            if not os.path.isfile(json_file):
-                print(f"Error: File {json_file} does not exist.")
-                return
-            if not is_valid_json(json_file):
-                print(f"Error: {json_file} is not a valid JSON file.")
-                return
             with open(json_file, "r") as f:
                 json_string = f.read()
-            root_node.add_child(ContextNode.from_json(json_string))
-    
-    print(f"Context data loaded:\n{str(root_node.to_dict())}")
+            namespace = root_node.add(ContextNode.from_json(json_string))
+            print(f"Loaded {json_file} as {namespace}")
 
-    chatbot = ContextChatBot(root_node, clipboard_mode=args.clipboard_mode)
+    chatbot = ContextChatBot(root_node, clipboard_mode=args.clipboard_mode, fan_out=args.fan_out,
+                             max_hops=args.max_hops, max_tokens=args.max_tokens, max_seconds=args.max_seconds, locale=args.locale)
 
     print("Type 'exit' to quit the application.")
     print(f"Clipboard mode: {args.clipboard_mode}")
     if args.clipboard_mode:
         print("Clipboard mode enabled. The AI response will be copied to your clipboard.")
-        clipboard.copy(SYSTEM_PROMPT)
+        import clipboard
+        clipboard.copy(chatbot.pack.SYSTEM_PROMPT)
         input("Now, paste the first system prompt into the chatbot. Press enter to continue.")
     while True:
         # question = input("Enter your question\n> ")
@@ -261,6 +453,9 @@ def main():
             question += line + "\n"
         question = question.strip()
         if question.lower() == "exit":
+            metrics.shutdown()
+            accounting.shutdown()
+            transcript.shutdown()
             break
         answer, reasoning, references = chatbot.ask(question)
         print(f"Assistant\n> {answer}\n")
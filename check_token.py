@@ -1,7 +1,13 @@
-import tiktoken
 from typing import Tuple
 
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about 4 characters per token) for when exact counts are not needed
+    """
+    return (len(text) + 3) // 4
+
 def check_token_length(input_text: str, max_token_length: int, model: str = "gpt-3.5-turbo") -> Tuple[bool, int]:
+    import tiktoken
     # Initialize the tiktoken tokenizer
     encoding = tiktoken.get_encoding("cl100k_base")
     encoding = tiktoken.encoding_for_model(model)
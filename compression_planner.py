@@ -0,0 +1,183 @@
+import argparse
+import json
+import math
+import os
+import accounting
+import metrics
+from check_token import estimate_tokens
+from context_tree import ContextNode
+from llm_compressor import compress
+
+MIN_WORDS = 15
+# Word budgets are rounded down to these steps, so that small shifts in the budgets do not re-summarize a node
+WORD_STEPS = sorted(set(int(MIN_WORDS * 1.25 ** i) for i in range(24)))
+# The key and quotes of a summary in a rendered context
+SUMMARY_OVERHEAD = estimate_tokens(',"summary":""')
+# Summaries made only to cluster siblings before the tree is planned need no more than the topic
+GROUPING_WORDS = 40
+
+def is_skipped(node: ContextNode) -> bool:
+    # generate_summary leaves the references without a summary
+    return "references&appendix" in node.node_id
+
+def heading_tokens(node: ContextNode) -> int:
+    return estimate_tokens(json.dumps({"id": node.node_id, "title": node.title}, ensure_ascii=False))
+
+def subtree_tokens(node: ContextNode, sizes: dict, headings: dict) -> int:
+    """
+    Content tokens of the node and its descendants, memoized in sizes by node id. headings gets the tokens of
+    the ids and titles in the subtree, which every context above the node shows.
+    """
+    size = estimate_tokens(node.content)
+    heading = heading_tokens(node)
+    for child in node.children:
+        size += subtree_tokens(child, sizes, headings)
+        heading += headings[child.node_id]
+    sizes[node.node_id] = size
+    headings[node.node_id] = heading
+    return size
+
+def round_words(words: float) -> int:
+    return max([step for step in WORD_STEPS if step <= words] or [MIN_WORDS])
+
+def tokens_per_word(root_node: ContextNode) -> float:
+    """
+    Tokens per word of the tree's text, as counted by estimate_tokens
+    """
+    words = 0
+    tokens = 0
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        for text in (node.content, node.summary):
+            words += len(text.split())
+            tokens += estimate_tokens(text)
+        stack += node.children
+    return tokens / words if words > 0 else 4 / 3
+
+def plan_compression(root_node: ContextNode, context_budget: int = 1500, root_budget: int = None) -> dict:
+    """
+    Summary budgets per node so that get_context(1) fits root_budget tokens at the root and context_budget tokens
+    at every other internal node. Each context is a node's summary, its children's summaries and the ids and
+    titles of all further descendants. What the ids and titles leave is shared by the summaries in proportion to the
+    square root of their subtree's size, so large sections get more words without crowding out the others.
+    Budgets are rounded down to WORD_STEPS. Returns node id -> {"compression_ratio", "max_words"}.
+    """
+    sizes = {}
+    headings = {}
+    subtree_tokens(root_node, sizes, headings)
+    token_ratio = tokens_per_word(root_node)
+    words = {}
+
+    def allocate(node: ContextNode, budget: int):
+        children = node.children
+        items = [child for child in children if not is_skipped(child)]
+        available = budget - headings[node.node_id]
+        if not items:
+            if node.node_id not in words:
+                # A root without children to share with has the budget to itself
+                words[node.node_id] = round_words(max(0, available - SUMMARY_OVERHEAD) / token_ratio)
+            return
+        weights = {child.node_id: math.sqrt(sizes[child.node_id] + 1) for child in items}
+        if node.node_id in words:
+            # The node's own summary was sized by its parent
+            available -= words[node.node_id] * token_ratio + SUMMARY_OVERHEAD
+        else:
+            weights[node.node_id] = sum(weights.values()) / len(weights)
+        available -= SUMMARY_OVERHEAD * len(weights)
+        total = sum(weights.values())
+        for node_id, weight in weights.items():
+            words[node_id] = round_words(max(0, available) * weight / total / token_ratio)
+        for child in items:
+            if child.children:
+                allocate(child, context_budget)
+
+    allocate(root_node, root_budget or context_budget)
+
+    plan = {}
+    def ratios(node: ContextNode):
+        # compress sees the node's content followed by its children's summaries
+        for child in node.children:
+            ratios(child)
+        if node.node_id not in words:
+            return
+        source_words = len(node.content.split()) + sum(words.get(child.node_id, 0) for child in node.children)
+        max_words = min(words[node.node_id], max(MIN_WORDS, source_words))
+        plan[node.node_id] = {"compression_ratio": f"1/{max(1, round(source_words / max_words))}", "max_words": max_words}
+    ratios(root_node)
+    return plan
+
+def summarize_with_plan(root_node: ContextNode, plan: dict, previous_plan: dict = None, title: bool = False, desc: str = "document") -> int:
+    """
+    Summarize, children first, the nodes whose budget is not the same as in previous_plan, that have no summary,
+    or that have a child summarized again, since a summary is made from the children's summaries. Nodes without a title, like the groups of reconstruct_tree, get the generated one. Returns the number of nodes summarized.
+    """
+    previous_plan = previous_plan or {}
+    summarized = 0
+    def summarize(node: ContextNode) -> bool:
+        # Whether the node got a new summary
+        nonlocal summarized
+        changed_children = [summarize(child) for child in node.children]
+        budget = plan.get(node.node_id)
+        if budget is None or (previous_plan.get(node.node_id) == budget and node.summary != "" and not any(changed_children)):
+            return False
+        print(f"Generating summary for {node.node_id} ({budget['max_words']} words)")
+        children_summaries = [child.summary for child in node.children]
+        with metrics.span("generate_summary", node=node.node_id), accounting.attribute(node=node.node_id):
+            generated_title, summary = compress(node.content + "\n".join(children_summaries), budget["compression_ratio"], budget["max_words"], desc=desc)
+        metrics.incr("summarized_nodes")
+        if (title or node.title == "") and generated_title != "":
+            node.title = generated_title
+        node.summary = summary
+        summarized += 1
+        return True
+    summarize(root_node)
+    return summarized
+
+def plan_path(tree_path: str) -> str:
+    return os.path.splitext(tree_path)[0] + ".plan.json"
+
+def load_plan(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_plan(plan: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Resize the summaries of an encoded tree to fit a token budget per context")
+    parser.add_argument("tree", type=str, help="The encoded JSON tree")
+    parser.add_argument("-b", "--context-budget", type=int, default=1500, help="Tokens of get_context(1) at each internal node")
+    parser.add_argument("--root-budget", type=int, help="Tokens of get_context(1) at the root, the context budget by default")
+    parser.add_argument("-d", "--desc", type=str, default="document", help="The description of the file to help encoder generate better summaries")
+    parser.add_argument("-o", "--output", type=str, help="The output json file, the input tree by default")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the planned budgets")
+    parser.add_argument("--usage", type=str, help="Append token usage and latency per node to this JSON lines file")
+    args = parser.parse_args()
+    if args.usage is not None:
+        accounting.configure(args.usage)
+
+    with open(args.tree, "r") as f:
+        root_node = ContextNode.from_json(f.read())
+    output = args.output or args.tree
+    # The plan the summaries were made with is kept next to the tree
+    previous_plan = load_plan(plan_path(args.tree))
+    plan = plan_compression(root_node, args.context_budget, args.root_budget)
+    changed = [node_id for node_id, budget in plan.items() if previous_plan.get(node_id) != budget]
+    for node_id, budget in plan.items():
+        print(f"{node_id:<40} {budget['compression_ratio']:>6} {budget['max_words']:>6}{' *' if node_id in changed else ''}")
+    print(f"{len(changed)} of {len(plan)} budgets changed")
+    if not args.dry_run:
+        with accounting.attribute(document=args.tree):
+            summarized = summarize_with_plan(root_node, plan, previous_plan, desc=args.desc)
+        with open(output, "w") as f:
+            f.write(root_node.to_json())
+        save_plan(plan, plan_path(output))
+        print(f"Summarized {summarized} nodes, root context is {estimate_tokens(root_node.render_context(1))} tokens")
+    accounting.shutdown()
+
+if __name__ == "__main__":
+    main()
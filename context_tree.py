@@ -0,0 +1,413 @@
+import json
+import math
+import accounting
+import metrics
+from llm_compressor import compress, group
+from typing import List
+from tree_store import TreeStore, TITLE, CONTENT, SUMMARY
+
+def preprocess_text(text) -> List[str]:
+    from nltk.tokenize import word_tokenize
+    from nltk.corpus import stopwords
+    # Tokenize, remove stopwords and non-alphabetical tokens
+    stop_words = set(stopwords.words('english'))
+    return [word for word in word_tokenize(text.lower()) if word.isalpha() and word not in stop_words]
+
+def identify_topics(texts, num_topics):
+    # gensim takes more than a second to import, so it is only loaded when a tree is built from unstructured text
+    from gensim import corpora, models
+    # Create a Gensim dictionary from the texts
+    dictionary = corpora.Dictionary(texts)
+    # Use the dictionary to prepare a DTM (Document Term Matrix)
+    dtm = [dictionary.doc2bow(doc) for doc in texts]
+    # Create an LDA model
+    lda_model = models.LdaModel(dtm, num_topics=num_topics, id2word=dictionary, passes=2)
+    # Get the dominant topic for each sentence
+    topics = [max(lda_model[doc], key=lambda x: x[1])[0] for doc in dtm if lda_model[doc]]
+    return topics
+
+def balance_groups(groups, num_items: int, num_groups: int, max_members: int):
+    """
+    Turn the (title, members) pairs proposed by the LLM into a valid partition of range(num_items):
+    duplicate and out-of-range members are dropped, oversized groups are split, and unassigned items
+    join the group of their preceding item when it has room. Falls back to contiguous, evenly sized
+    groups if the proposal is unusable or would not reduce the number of nodes.
+    """
+    seen = set()
+    cleaned = []
+    for title, members in groups:
+        members = sorted(set(m for m in members if 0 <= m < num_items and m not in seen))
+        seen.update(members)
+        for start in range(0, len(members), max_members):
+            cleaned.append((title if start == 0 else "", members[start:start + max_members]))
+    for i in range(num_items):
+        if i in seen:
+            continue
+        target = next((g for g in cleaned if i - 1 in g[1] and len(g[1]) < max_members), None)
+        if target is None:
+            target = next((g for g in cleaned if len(g[1]) < max_members), None)
+        if target is None:
+            target = ("", [])
+            cleaned.append(target)
+        target[1].append(i)
+        target[1].sort()
+        seen.add(i)
+    if len(cleaned) == 0 or len(cleaned) >= num_items:
+        size = math.ceil(num_items / num_groups)
+        cleaned = [("", list(range(start, min(start + size, num_items)))) for start in range(0, num_items, size)]
+    cleaned.sort(key=lambda g: g[1][0])
+    return cleaned
+
+def namespaced_id(namespace: str, node_id: str) -> str:
+    """
+    The id of a node as seen through a DocumentForest. Ids that already start with the namespace,
+    like the ids the parsers prefix with the root id, are used as they are.
+    """
+    if namespace == "" or node_id == namespace or node_id.startswith(namespace + "."):
+        return node_id
+    return f"{namespace}:{node_id}"
+
+class ContextNode:
+    """
+    A node of a context tree. Nodes are views into a TreeStore that holds the whole tree in flat arrays.
+    Creating a node without a store starts a new tree; adding a node of another tree as a child copies
+    its subtree into this tree and moves the added node (not other references into the old tree) along.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, node_id: str, title: str = "", content: str = "", summary: str = "", store: TreeStore = None):
+        self.store = store if store is not None else TreeStore()
+        self.index = self.store.add_node(node_id, title, content, summary)
+
+    @classmethod
+    def view(cls, store: TreeStore, index: int):
+        node = cls.__new__(cls)
+        node.store = store
+        node.index = index
+        return node
+
+    def __eq__(self, other):
+        return isinstance(other, ContextNode) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def node_id(self):
+        return self.store.get_id(self.index)
+
+    @node_id.setter
+    def node_id(self, value):
+        self.store.set_id(self.index, value)
+
+    @property
+    def title(self):
+        return self.store.get_text(self.index, TITLE)
+
+    @title.setter
+    def title(self, value):
+        self.store.set_text(self.index, TITLE, value)
+
+    @property
+    def content(self):
+        return self.store.get_text(self.index, CONTENT)
+
+    @content.setter
+    def content(self, value):
+        self.store.set_text(self.index, CONTENT, value)
+
+    @property
+    def summary(self):
+        return self.store.get_text(self.index, SUMMARY)
+
+    @summary.setter
+    def summary(self, value):
+        self.store.set_text(self.index, SUMMARY, value)
+
+    @property
+    def children(self):
+        return [ContextNode.view(self.store, child) for child in self.store.children(self.index)]
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        return ContextNode.view(self.store, parent) if parent != -1 else None
+
+    def add_child(self, child):
+        if child.store is not self.store or self.store.parent[child.index] != -1:
+            child.index = self.store.copy_subtree(child.store, child.index)
+            child.store = self.store
+        self.store.append_child(self.index, child.index)
+
+    def clear_children(self):
+        self.store.detach_children(self.index)
+
+    def invalidate_context(self):
+        """
+        Drop the rendered contexts of the node and its ancestors, whose renderings include this node
+        """
+        self.store.invalidate(self.index)
+
+    def to_dict(self):
+        return {
+            "id": self.node_id,
+            "title": self.title,
+            "content": self.content,
+            "summary": self.summary,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def to_json(self, indent=4):
+        return json.dumps(self.to_dict(), indent=indent)
+    
+    @classmethod
+    def from_dict(cls, data, store: TreeStore = None):
+        node = cls(
+            node_id=data.get("id", ""),
+            title=data.get("title", ""),
+            content=data.get("content", ""),
+            summary=data.get("summary", ""),
+            store=store,
+        )
+        for child_data in data.get("children", []):
+            child = cls.from_dict(child_data, node.store)
+            node.add_child(child)
+        return node
+    
+    @classmethod
+    def from_json(cls, json_string):
+        data = json.loads(json_string)
+        return cls.from_dict(data)
+    
+    def get_node(self, node_id):
+        index = self.store.find(node_id, self.index)
+        return ContextNode.view(self.store, index) if index != -1 else None
+    
+    def get_id_list(self, depth: int = 1):
+        id_list = [self.node_id]
+        if depth < 0:
+            return []
+        for child in self.children:
+            id_list += child.get_id_list()
+        return id_list
+
+    def generate_summary(self, recursive: bool = True, compression_ratio: str = "1/4", title: bool = False, desc: str = "document", progress=None,
+                         max_words: int = 200):
+        """
+        Generate the summary of the node and its children. progress is called with each node once it is done.
+        """
+        if len(self.children) > 0 and recursive:
+            for child in self.children:
+                child.generate_summary(recursive, compression_ratio, title, desc, progress, max_words)
+        children_summaries = [child.summary for child in self.children]
+        if "references&appendix" in self.node_id:
+            if progress is not None:
+                progress(self)
+            return
+        print(f"Generating summary for {self.node_id}")
+        with metrics.span("generate_summary", node=self.node_id), accounting.attribute(node=self.node_id):
+            generated_title, summary = compress(self.content + "\n".join(children_summaries), compression_ratio, max_words, desc=desc)
+        metrics.incr("summarized_nodes")
+        if title and generated_title != "":
+            self.title = generated_title
+        self.summary = summary
+        print(f"Title: {self.title}")
+        print(f"Summary length: {len(self.summary.split(' '))} words")
+        if progress is not None:
+            progress(self)
+    
+    def reconstruct_tree(self, max_children: int = 8, compression_ratio: str = "1/4", desc: str = "document", summarize: bool = True):
+        """
+        Reconstruct the flat tree into a multi-level tree with at most max_children children per node.
+        Siblings are clustered by their summaries into intermediate nodes, so generate_summary must run first.
+        With summarize set to False the new nodes are left without a summary, for a caller that summarizes afterwards.
+        """
+        if max_children < 2:
+            raise ValueError("max_children must be at least 2")
+        for child in self.children:
+            child.reconstruct_tree(max_children, compression_ratio, desc, summarize)
+        level = 1
+        while len(self.children) > max_children:
+            self.group_children(max_children, level, compression_ratio, desc, summarize)
+            level += 1
+
+    @metrics.timed("group_children")
+    def group_children(self, max_children: int, level: int = 1, compression_ratio: str = "1/4", desc: str = "document", summarize: bool = True):
+        """
+        Group the children of the node into intermediate nodes using one batched LLM call, then summarize the new nodes
+        """
+        children = self.children
+        # Leave some room in each group so the LLM can cluster by topic instead of cutting at fixed positions
+        target_size = max(2, math.ceil(max_children * 3 / 4))
+        num_groups = math.ceil(len(children) / target_size)
+        sections = [(child.title, child.summary) for child in children]
+        with accounting.attribute(node=self.node_id):
+            proposed_groups = group(sections, num_groups, max_children, desc)
+        groups = balance_groups(proposed_groups, len(children), num_groups, max_children)
+        print(f"Grouped {len(children)} children of {self.node_id} into {len(groups)} nodes")
+        metrics.incr("group_nodes", len(groups))
+        self.clear_children()
+        for i, (group_title, members) in enumerate(groups):
+            group_node = ContextNode(f"{self.node_id}.group_{level}_{i+1}", title=group_title, store=self.store)
+            for member in members:
+                group_node.add_child(children[member])
+            if not summarize:
+                self.add_child(group_node)
+                continue
+            with accounting.attribute(node=group_node.node_id):
+                generated_title, summary = compress("\n".join(child.summary for child in group_node.children), compression_ratio, desc=desc)
+            if group_node.title == "":
+                group_node.title = generated_title
+            group_node.summary = summary
+            self.add_child(group_node)
+
+    def get_context(self, depth: int = 0, original: bool = False, namespace: str = ""):
+        """
+        Get the context of the node and its children, with ids qualified by the namespace of a DocumentForest
+        """
+        children = self.children
+        if depth > 0 and len(children) == 0:
+            original = True
+        if depth < 0:
+            content = ""
+            summary = ""
+        else:
+            content = self.content if original else ""
+            summary = self.summary if not original else ""
+        context = {
+            "id": namespaced_id(namespace, self.node_id),
+            "title": self.title
+        }
+        if content != "":
+            context["content"] = content
+        if summary != "":
+            context["summary"] = summary
+        if children == []:
+            return context
+        context["children"] = []
+        for child in children:
+            context["children"].append(child.get_context(depth - 1, original=False, namespace=namespace))
+        return context
+
+    def render_context(self, depth: int = 0, original: bool = False, namespace: str = "") -> str:
+        """
+        Compact JSON of get_context(depth, original). Renderings are cached per node and reused by
+        the parent's rendering, so after a change only the path from the changed node to the root is re-rendered.
+        """
+        if depth > 0 and self.store.first_child[self.index] == -1:
+            original = True
+        if depth < 0:
+            # Below the requested depth only ids and titles are rendered
+            depth, original = -1, False
+        key = (depth, original, namespace)
+        cache = self.store.context_cache.get(self.index)
+        if cache is not None and key in cache:
+            metrics.incr("context_cache_hits")
+            return cache[key]
+        metrics.incr("context_cache_misses")
+        parts = ['{"id":', json.dumps(namespaced_id(namespace, self.node_id), ensure_ascii=False), ',"title":', json.dumps(self.title, ensure_ascii=False)]
+        if depth >= 0 and original and self.content != "":
+            parts += [',"content":', json.dumps(self.content, ensure_ascii=False)]
+        if depth >= 0 and not original and self.summary != "":
+            parts += [',"summary":', json.dumps(self.summary, ensure_ascii=False)]
+        children = self.children
+        if len(children) > 0:
+            parts.append(',"children":[')
+            parts.append(",".join(child.render_context(depth - 1, False, namespace) for child in children))
+            parts.append("]")
+        parts.append("}")
+        rendered = "".join(parts)
+        self.store.context_cache.setdefault(self.index, {})[key] = rendered
+        return rendered
+
+    def write_context(self, buffer, depth: int = 0, original: bool = False, namespace: str = ""):
+        """
+        Write the rendered context into a prompt buffer such as io.StringIO
+        """
+        buffer.write(self.render_context(depth, original, namespace))
+    
+    def prepend_node_id(self, node_id: str):
+        if not self.node_id.startswith(node_id):
+            self.node_id = node_id + "." + self.node_id
+        for child in self.children:
+            child.prepend_node_id(node_id)
+    
+    def apply_word_limit(self, limit: int = 2000, overlap: int = 100, recursive: bool = True):
+        words = self.content.split()
+        print(f"Word count for {self.node_id}: {len(words)}")
+        if len(words) <= limit:
+            return
+
+        # Split content into chunks
+        chunks = []
+        while len(words) > limit:
+            chunk = words[:limit]
+            chunks.append(chunk)
+            words = words[limit-overlap:]
+        if len(words) > 0:
+            chunks.append(words)
+        print(f"Chunked {self.node_id} into {len(chunks)} chunks")
+        metrics.incr("chunks", len(chunks))
+        # Assign chunked content to child nodes, ahead of the existing children such as subsections
+        children = self.children
+        self.clear_children()
+        for i, chunk in enumerate(chunks):
+            node_id = f"{self.node_id}.chunk_{i+1}"
+            node_title = f"Chunk {i+1}"
+            node_content = " ".join(chunk)
+            chunk_node = ContextNode(node_id, title=node_title, content=node_content, store=self.store)
+            self.add_child(chunk_node)
+        for child in children:
+            self.add_child(child)
+
+        # Replace the original content with a string indicating that contents are chunked and in children
+        self.content = f"Content is too long and is chunked into {len(chunks)} child nodes."
+
+        # Recursively apply word limit to child nodes
+        if recursive:
+            for child in self.children:
+                child.apply_word_limit(limit, overlap, recursive)
+    
+    @metrics.timed("build_tree")
+    def build_tree(self, num_topics: int = 0, max_tokens: int = 2000, recursive: bool = True):
+        """
+        Generate context tree for unstructured text. This will not preserve the original flow of the text.
+
+        Args:
+            num_topics (int, optional): Maximum number of topics on the first level. Defaults to 0.
+            max_tokens (int, optional): Ideal maximum token size. Defaults to 2000.
+        """
+        from nltk.tokenize import word_tokenize, sent_tokenize
+        print(f"Token count for {self.node_id}: {len(word_tokenize(self.content))}")
+        text = self.content
+        self.content = ""
+        # Split text into sentences
+        sentences = sent_tokenize(text)
+        # Preprocess sentences
+        texts = [preprocess_text(sentence) for sentence in sentences]
+        if num_topics == 0:
+            # Predict number of topics
+            token_count = len(word_tokenize(text))
+            num_topics = min(10, (token_count // max_tokens))
+        # Identify topics
+        topics = identify_topics(texts, num_topics)
+        # Get the actual number of topics
+        num_topics = len(set(topics))
+        print("Number of topics:", num_topics)
+        if num_topics == 1:
+            self.content = text
+            return
+        # Collect the sentences of each topic in order of first appearance, then create one node per topic
+        topic_sentences = {}
+        for i, topic in enumerate(topics):
+            topic_id = f"{self.node_id}.{topic + 1}"
+            topic_sentences.setdefault(topic_id, []).append(f" {sentences[i]}")
+        for topic_id, topic_text in topic_sentences.items():
+            self.add_child(ContextNode(topic_id, content="".join(topic_text), store=self.store))
+        
+        # Recursively build tree for child nodes
+        if recursive:
+            for child in self.children:
+                token_count = len(word_tokenize(child.content))
+                if token_count > max_tokens:
+                    child.build_tree(0, max_tokens)
@@ -0,0 +1,289 @@
+import argparse
+import os
+import sqlite3
+import time
+import metrics
+from typing import List
+from context_tree import ContextNode
+from forest import DocumentForest
+from tree_store import TreeStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    node_count INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    rowid INTEGER PRIMARY KEY,
+    doc_id INTEGER NOT NULL REFERENCES documents(doc_id) ON DELETE CASCADE,
+    pre INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    parent INTEGER,
+    depth INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    UNIQUE (doc_id, pre)
+);
+CREATE INDEX IF NOT EXISTS nodes_by_id ON nodes (node_id, doc_id);
+CREATE INDEX IF NOT EXISTS nodes_by_parent ON nodes (doc_id, parent);
+CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(title, summary, content, content='nodes', content_rowid='rowid');
+"""
+
+class DocumentStore:
+    """
+    SQLite storage for many encoded context trees. Nodes are numbered in pre-order within their document
+    and keep the number of the last node of their subtree, so any subtree is one range scan on (doc_id, pre).
+    Titles, summaries and contents are indexed for full-text search.
+    """
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        # Rendered contexts keyed by (doc_id, pre, depth, original), dropped when a document changes
+        self.context_cache = {}
+
+    def close(self):
+        self.connection.close()
+
+    def add_document(self, root_node: ContextNode, name: str = None) -> int:
+        """
+        Store a context tree under name (the root node id by default), replacing a document with the same name
+        """
+        name = name or root_node.node_id
+        rows = []
+        # Iterative pre-order traversal, the last descendant of each node is filled in once its subtree is done
+        stack = [(root_node, None, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            pre = len(rows)
+            rows.append([pre, pre, parent, depth, node.node_id, node.title, node.content, node.summary])
+            for child in reversed(node.children):
+                stack.append((child, pre, depth + 1))
+        for row in reversed(rows):
+            if row[2] is not None:
+                rows[row[2]][1] = max(rows[row[2]][1], row[1])
+        with self.connection:
+            # The old document is deleted in the same transaction, so it is kept if the insert fails
+            removed = self.delete_rows(name)
+            cursor = self.connection.execute(
+                "INSERT INTO documents (name, node_count, created) VALUES (?, ?, ?)", (name, len(rows), time.time()))
+            doc_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO nodes (doc_id, pre, last, parent, depth, node_id, title, content, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ([doc_id] + row for row in rows))
+            self.connection.execute(
+                "INSERT INTO nodes_fts (rowid, title, summary, content) SELECT rowid, title, summary, content FROM nodes WHERE doc_id = ?", (doc_id,))
+        if removed is not None:
+            self.uncache(removed)
+        return doc_id
+
+    def delete_rows(self, name: str) -> int:
+        """
+        Delete a document's rows without committing, the caller holds the transaction. Returns its doc_id or None.
+        """
+        row = self.connection.execute("SELECT doc_id FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "INSERT INTO nodes_fts (nodes_fts, rowid, title, summary, content) SELECT 'delete', rowid, title, summary, content FROM nodes WHERE doc_id = ?", row)
+        self.connection.execute("DELETE FROM nodes WHERE doc_id = ?", row)
+        self.connection.execute("DELETE FROM documents WHERE doc_id = ?", row)
+        return row[0]
+
+    def uncache(self, doc_id: int):
+        self.context_cache = {key: value for key, value in self.context_cache.items() if key[0] != doc_id}
+
+    def remove_document(self, name: str) -> bool:
+        with self.connection:
+            doc_id = self.delete_rows(name)
+        if doc_id is None:
+            return False
+        self.uncache(doc_id)
+        return True
+
+    def list_documents(self) -> List[dict]:
+        rows = self.connection.execute(
+            "SELECT d.doc_id, d.name, d.node_count, n.node_id, n.title FROM documents d JOIN nodes n ON n.doc_id = d.doc_id AND n.pre = 0 ORDER BY d.doc_id")
+        return [{"doc_id": doc_id, "name": name, "node_count": node_count, "root_id": root_id, "title": title} for doc_id, name, node_count, root_id, title in rows]
+
+    def document_id(self, name: str) -> int:
+        row = self.connection.execute("SELECT doc_id FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"No document named {name}")
+        return row[0]
+
+    def load_tree(self, name: str) -> ContextNode:
+        """
+        Load a whole document as a ContextNode tree
+        """
+        return self.load_range(self.document_id(name), 0)
+
+    def load_range(self, doc_id: int, pre: int, depth: int = None) -> ContextNode:
+        """
+        Load the subtree rooted at pre. With a depth, only ids and titles are loaded below that many levels,
+        and contents only above it, which is all get_context(depth) needs.
+        """
+        root = self.connection.execute("SELECT last, depth FROM nodes WHERE doc_id = ? AND pre = ?", (doc_id, pre)).fetchone()
+        if root is None:
+            return None
+        last, root_depth = root
+        if depth is None:
+            rows = self.connection.execute(
+                "SELECT pre, parent, node_id, title, content, summary FROM nodes WHERE doc_id = ? AND pre BETWEEN ? AND ? ORDER BY pre",
+                (doc_id, pre, last))
+        else:
+            rows = self.connection.execute(
+                "SELECT pre, parent, node_id, title, CASE WHEN depth < ? THEN content ELSE '' END, CASE WHEN depth <= ? THEN summary ELSE '' END "
+                "FROM nodes WHERE doc_id = ? AND pre BETWEEN ? AND ? ORDER BY pre",
+                (root_depth + max(depth, 1), root_depth + depth, doc_id, pre, last))
+        return build_tree(rows)
+
+    def find_node(self, node_id: str, doc_ids: List[int] = None):
+        """
+        (doc_id, pre) of the first node with node_id, optionally only in the given documents
+        """
+        query = "SELECT doc_id, pre FROM nodes WHERE node_id = ?"
+        params = [node_id]
+        if doc_ids is not None:
+            query += f" AND doc_id IN ({','.join('?' * len(doc_ids))})"
+            params += doc_ids
+        return self.connection.execute(query + " ORDER BY doc_id, pre LIMIT 1", params).fetchone()
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        Full-text search over titles, summaries and contents
+        """
+        rows = self.connection.execute(
+            "SELECT d.name, n.node_id, n.title, snippet(nodes_fts, -1, '[', ']', '...', 12) FROM nodes_fts "
+            "JOIN nodes n ON n.rowid = nodes_fts.rowid JOIN documents d ON d.doc_id = n.doc_id "
+            "WHERE nodes_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit))
+        return [{"document": name, "id": node_id, "title": title, "snippet": snippet} for name, node_id, title, snippet in rows]
+
+    def node(self, doc_id: int, pre: int) -> "StoredNode":
+        return StoredNode(self, doc_id, pre)
+
+    def library(self, names: List[str] = None) -> DocumentForest:
+        """
+        A forest of the given documents (all by default) that the chatbot can use like a ContextNode.
+        Only the document ids are read, contexts are loaded from the database when they are rendered.
+        """
+        documents = {doc["name"]: doc for doc in self.list_documents()}
+        for name in names or []:
+            if name not in documents:
+                raise KeyError(f"No document named {name}")
+        forest = DocumentForest()
+        for name in names or documents:
+            doc = documents[name]
+            forest.add(StoredNode(self, doc["doc_id"], 0, doc["root_id"], doc["title"]))
+        return forest
+
+def build_tree(rows) -> ContextNode:
+    """
+    Build a ContextNode tree from (pre, parent, node_id, title, content, summary) rows in pre-order
+    """
+    store = TreeStore()
+    nodes = {}
+    root = None
+    for pre, parent, node_id, title, content, summary in rows:
+        node = ContextNode(node_id, title, content, summary, store=store)
+        if parent in nodes:
+            nodes[parent].add_child(node)
+        elif root is None:
+            root = node
+        nodes[pre] = node
+    return root
+
+class StoredNode:
+    """
+    A node of a stored document. Only the rows needed for the requested context are read from the database.
+    """
+    def __init__(self, store: DocumentStore, doc_id: int, pre: int, node_id: str = None, title: str = None):
+        self.store = store
+        self.doc_id = doc_id
+        self.pre = pre
+        if node_id is None:
+            node_id, title = store.connection.execute(
+                "SELECT node_id, title FROM nodes WHERE doc_id = ? AND pre = ?", (doc_id, pre)).fetchone()
+        self.node_id = node_id
+        self.title = title
+
+    @property
+    def children(self):
+        rows = self.store.connection.execute("SELECT pre FROM nodes WHERE doc_id = ? AND parent = ? ORDER BY pre", (self.doc_id, self.pre))
+        return [StoredNode(self.store, self.doc_id, pre) for pre, in rows]
+
+    def get_node(self, node_id: str):
+        row = self.store.connection.execute(
+            "SELECT n.pre FROM nodes n JOIN nodes r ON r.doc_id = n.doc_id AND r.pre = ? "
+            "WHERE n.node_id = ? AND n.doc_id = ? AND n.pre BETWEEN r.pre AND r.last ORDER BY n.pre LIMIT 1",
+            (self.pre, node_id, self.doc_id)).fetchone()
+        return StoredNode(self.store, self.doc_id, row[0]) if row is not None else None
+
+    def get_context(self, depth: int = 0, original: bool = False, namespace: str = ""):
+        return self.store.load_range(self.doc_id, self.pre, max(depth, 0)).get_context(depth, original, namespace)
+
+    def render_context(self, depth: int = 0, original: bool = False, namespace: str = "") -> str:
+        key = (self.doc_id, self.pre, depth, original, namespace)
+        if key in self.store.context_cache:
+            metrics.incr("stored_context_cache_hits")
+        else:
+            metrics.incr("stored_context_cache_misses")
+            self.store.context_cache[key] = self.store.load_range(self.doc_id, self.pre, max(depth, 0)).render_context(depth, original, namespace)
+        return self.store.context_cache[key]
+
+    def write_context(self, buffer, depth: int = 0, original: bool = False, namespace: str = ""):
+        buffer.write(self.render_context(depth, original, namespace))
+
+    def to_dict(self):
+        return self.store.load_range(self.doc_id, self.pre).to_dict()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a database of encoded documents")
+    parser.add_argument("database", type=str, help="The SQLite database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Add encoded JSON trees")
+    add_parser.add_argument("files", nargs="+", help="JSON files written by the encoder")
+    remove_parser = subparsers.add_parser("remove", help="Remove documents")
+    remove_parser.add_argument("names", nargs="+", help="Document names")
+    subparsers.add_parser("list", help="List the documents")
+    search_parser = subparsers.add_parser("search", help="Full-text search")
+    search_parser.add_argument("query", type=str, help="An FTS5 query")
+    search_parser.add_argument("-n", "--limit", type=int, default=10, help="Maximum number of results")
+    export_parser = subparsers.add_parser("export", help="Write a document back to JSON")
+    export_parser.add_argument("name", type=str, help="Document name")
+    export_parser.add_argument("-o", "--output", type=str, help="The output json file")
+    args = parser.parse_args()
+
+    store = DocumentStore(args.database)
+    if args.command == "add":
+        for file_path in args.files:
+            with open(file_path, "r") as f:
+                root_node = ContextNode.from_json(f.read())
+            name = os.path.basename(file_path).split(".")[0]
+            store.add_document(root_node, name)
+            print(f"Added {file_path} as {name}")
+    elif args.command == "remove":
+        for name in args.names:
+            print(f"Removed {name}" if store.remove_document(name) else f"No document named {name}")
+    elif args.command == "list":
+        for doc in store.list_documents():
+            print(f"{doc['name']:<30} {doc['node_count']:>8} nodes  {doc['title']}")
+    elif args.command == "search":
+        for result in store.search(args.query, args.limit):
+            print(f"{result['document']}: {result['id']} ({result['title']})\n    {result['snippet']}")
+    elif args.command == "export":
+        json_string = store.load_tree(args.name).to_json()
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(json_string)
+        else:
+            print(json_string)
+    store.close()
+
+if __name__ == "__main__":
+    main()
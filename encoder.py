@@ -1,29 +1,14 @@
-import PyPDF2
 import json
 import argparse
 import os
-from gensim import corpora, models
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.corpus import stopwords
-from tqdm import tqdm
-from llm_compressor import compress
-from typing import List
-
-def preprocess_text(text) -> List[str]:
-    # Tokenize, remove stopwords and non-alphabetical tokens
-    stop_words = set(stopwords.words('english'))
-    return [word for word in word_tokenize(text.lower()) if word.isalpha() and word not in stop_words]
-
-def identify_topics(texts, num_topics):
-    # Create a Gensim dictionary from the texts
-    dictionary = corpora.Dictionary(texts)
-    # Use the dictionary to prepare a DTM (Document Term Matrix)
-    dtm = [dictionary.doc2bow(doc) for doc in texts]
-    # Create an LDA model
-    lda_model = models.LdaModel(dtm, num_topics=num_topics, id2word=dictionary, passes=2)
-    # Get the dominant topic for each sentence
-    topics = [max(lda_model[doc], key=lambda x: x[1])[0] for doc in dtm if lda_model[doc]]
-    return topics
+import accounting
+import metrics
+import transcript
+from api import set_temperature
+from compression_planner import GROUPING_WORDS, plan_compression, summarize_with_plan, save_plan, plan_path
+# The tree itself lives in context_tree.py, these names are kept importable from here.
+# PyPDF2 and tqdm are imported by the parsers that use them, so that loading a tree stays fast.
+from context_tree import ContextNode, namespaced_id, balance_groups, preprocess_text, identify_topics
 
 class TOCNode:
     def __init__(self, node_id: str, title: str, page_number: int):
@@ -43,194 +28,53 @@ class TOCNode:
         for child in self.children:
             child.display(level + 1)
 
-class ContextNode:
-    def __init__(self, node_id: str, title: str = "", content: str = "", summary: str = ""):
-        self.node_id = node_id
-        self.title = title
-        self.content = content
-        self.children = []
-        self.summary = summary
-
-    def add_child(self, child):
-        self.children.append(child)
-
-    def to_dict(self):
-        return {
-            "id": self.node_id,
-            "title": self.title,
-            "content": self.content,
-            "summary": self.summary,
-            "children": [child.to_dict() for child in self.children],
-        }
-
-    def to_json(self, indent=4):
-        return json.dumps(self.to_dict(), indent=indent)
-    
-    @classmethod
-    def from_dict(cls, data):
-        node = cls(
-            node_id=data.get("id", ""),
-            title=data.get("title", ""),
-            content=data.get("content", ""),
-            summary=data.get("summary", ""),
-        )
-        for child_data in data.get("children", []):
-            child = cls.from_dict(child_data)
-            node.add_child(child)
-        return node
-    
-    @classmethod
-    def from_json(cls, json_string):
-        data = json.loads(json_string)
-        return cls.from_dict(data)
-    
-    def get_node(self, node_id):
-        if self.node_id == node_id:
-            return self
-        for child in self.children:
-            found_node = child.get_node(node_id)
-            if found_node is not None:
-                return found_node
-        return None
-    
-    def get_id_list(self, depth: int = 1):
-        id_list = [self.node_id]
-        if depth < 0:
-            return []
-        for child in self.children:
-            id_list += child.get_id_list()
-        return id_list
-
-    def generate_summary(self, recursive: bool = True, compression_ratio: str = "1/4", title: bool = False, desc: str = "document"):
-        """
-        Generate the summary of the node and its children
-        """
-        if len(self.children) > 0 and recursive:
-            for child in self.children:
-                child.generate_summary(recursive, compression_ratio, title)
-        children_summaries = [child.summary for child in self.children]
-        if "references&appendix" in self.node_id:
-            return
-        print(f"Generating summary for {self.node_id}")
-        generated_title, summary = compress(self.content + "\n".join(children_summaries), compression_ratio, desc=desc)
-        if title:
-            self.title = generated_title
-        self.summary = summary
-        print(f"Title: {self.title}")
-        print(f"Summary length: {len(self.summary.split(' '))} words")
-    
-    def get_context(self, depth: int = 0, original: bool = False):
+    def flatten(self):
         """
-        Get the context of the node and its children
+        Return the node and its descendants in pre-order, which is the reading order of the document
         """
-        if depth > 0 and len(self.children) == 0:
-            original = True
-        if depth < 0:
-            content = ""
-            summary = ""
-        else:
-            content = self.content if original else ""
-            summary = self.summary if not original else ""
-        context = {
-            "id": self.node_id,
-            "title": self.title
-        }
-        if content != "":
-            context["content"] = content
-        if summary != "":
-            context["summary"] = summary
-        if self.children == []:
-            return context
-        context["children"] = []
-        for child in self.children:
-            context["children"].append(child.get_context(depth - 1, original=False))
-        return context
-    
-    def prepend_node_id(self, node_id: str):
-        if not self.node_id.startswith(node_id):
-            self.node_id = node_id + "." + self.node_id
+        nodes = [self]
         for child in self.children:
-            child.prepend_node_id(node_id)
-    
-    def apply_word_limit(self, limit: int = 2000, overlap: int = 100, recursive: bool = True):
-        words = self.content.split()
-        print(f"Word count for {self.node_id}: {len(words)}")
-        if len(words) <= limit:
-            return
-
-        # Split content into chunks
-        chunks = []
-        while len(words) > limit:
-            chunk = words[:limit]
-            chunks.append(chunk)
-            words = words[limit-overlap:]
-        if len(words) > 0:
-            chunks.append(words)
-        print(f"Chunked {self.node_id} into {len(chunks)} chunks")
-        # Assign chunked content to child nodes
-        self.children = []
-        for i, chunk in enumerate(chunks):
-            node_id = f"{self.node_id}.chunk_{i+1}"
-            node_title = f"Chunk {i+1}"
-            node_content = " ".join(chunk)
-            chunk_node = ContextNode(node_id, title=node_title, content=node_content)
-            self.children.append(chunk_node)
+            nodes += child.flatten()
+        return nodes
 
-        # Replace the original content with a string indicating that contents are chunked and in children
-        self.content = f"Content is too long and is chunked into {len(chunks)} child nodes."
-
-        # Recursively apply word limit to child nodes
-        if recursive:
-            for child in self.children:
-                child.apply_word_limit(limit, overlap, recursive)
-    
-    def build_tree(self, num_topics: int = 0, max_tokens: int = 2000, recursive: bool = True):
+    @classmethod
+    def from_dict(cls, data, node_id: str = "", page_offset: int = 0):
         """
-        Generate context tree for unstructured text. This will not preserve the original flow of the text.
+        Build a TOC tree from {"title": ..., "page": ..., "children": [...]}. Children ids are dotted positions.
+        """
+        node = cls(node_id, data.get("title", ""), int(data.get("page", 1)) + page_offset)
+        for i, child_data in enumerate(data.get("children", [])):
+            child_id = f"{node_id}.{i + 1}" if node_id else f"{i + 1}"
+            node.add_child(cls.from_dict(child_data, child_id, page_offset))
+        return node
 
-        Args:
-            num_topics (int, optional): Maximum number of topics on the first level. Defaults to 0.
-            max_tokens (int, optional): Ideal maximum token size. Defaults to 2000.
+    @classmethod
+    def from_outline(cls, pdf_reader):
+        """
+        Build a TOC tree from the outline (bookmarks) embedded in the PDF
         """
-        print(f"Token count for {self.node_id}: {len(word_tokenize(self.content))}")
-        text = self.content
-        self.content = ""
-        # Split text into sentences
-        sentences = sent_tokenize(text)
-        # Preprocess sentences
-        texts = [preprocess_text(sentence) for sentence in sentences]
-        if num_topics == 0:
-            # Predict number of topics
-            token_count = len(word_tokenize(text))
-            num_topics = min(10, (token_count // max_tokens))
-        # Identify topics
-        topics = identify_topics(texts, num_topics)
-        # Get the actual number of topics
-        num_topics = len(set(topics))
-        print("Number of topics:", num_topics)
-        if num_topics == 1:
-            self.content = text
-            return
-        for i, topic in enumerate(topics):
-            topic_id = f"{self.node_id}.{topic + 1}"
-            # Check if the topic node already exists, if not create it
-            topic_node = next((child for child in self.children if child.node_id == topic_id), None)
-            if not topic_node:
-                topic_node = ContextNode(topic_id)
-                self.add_child(topic_node)
-            # Add the sentence node to the topic node
-            sentence = sentences[i]
-            topic_node.content += f" {sentence}"
-        
-        # Recursively build tree for child nodes
-        if recursive:
-            for child in self.children:
-                token_count = len(word_tokenize(child.content))
-                if token_count > max_tokens:
-                    child.build_tree(0, max_tokens)
+        def add_items(parent, items):
+            for item in items:
+                if isinstance(item, list):
+                    # A nested list holds the children of the preceding outline item
+                    if parent.children:
+                        add_items(parent.children[-1], item)
+                    continue
+                child_id = f"{parent.node_id}.{len(parent.children) + 1}" if parent.node_id else f"{len(parent.children) + 1}"
+                try:
+                    page_number = pdf_reader.get_destination_page_number(item) + 1
+                except Exception:
+                    page_number = parent.page_number
+                parent.add_child(cls(child_id, str(item.title), page_number))
+        root = cls("", "", 1)
+        add_items(root, pdf_reader.outline)
+        return root
 
+@metrics.timed("extract_text_from_pdf")
 def extract_text_from_pdf(file_path):
     print(f"Extracting text from {file_path}")
+    import PyPDF2
+    from tqdm import tqdm
     with open(file_path, "rb") as file:
         pdf_reader = PyPDF2.PdfReader(file)
         text = ""
@@ -238,6 +82,7 @@ def extract_text_from_pdf(file_path):
             text += page.extract_text()
     return text
 
+@metrics.timed("parse_paper")
 def parse_paper(file_path):
     text = extract_text_from_pdf(file_path)
     root_id = "".join(file_path.split("/")[-1].split(".")[0:-1]).replace(" ", "_")
@@ -301,7 +146,7 @@ def parse_paper(file_path):
     
     # Add abstract node
     root_node = ContextNode(root_id, root_id, "")
-    abstract_node = ContextNode("abstract", "Abstract", "\n".join(lines[abstract_start + 1:abstract_end]).strip())
+    abstract_node = ContextNode("abstract", "Abstract", "\n".join(lines[abstract_start + 1:abstract_end]).strip(), store=root_node.store)
     root_node.add_child(abstract_node)
     
     for i, candidate in enumerate(node_candidates):
@@ -327,24 +172,24 @@ def parse_paper(file_path):
 
         node_title = lines[candidate["line"]].strip()
         node_content = "\n".join(lines[candidate["line"]:end_index]).strip()
-        current_node = ContextNode(".".join(map(str, current_code)), node_title, node_content)
+        current_node = ContextNode(".".join(map(str, current_code)), node_title, node_content, store=root_node.store)
 
         # Determine the parent of the current node
         while current_parent.node_id != root_id and len(current_node.node_id) <= len(current_parent.node_id):
             current_parent = current_parent.parent if current_parent.parent else root_node
 
-        current_node.parent = current_parent
         current_parent.add_child(current_node)
         current_parent = current_node
 
     # Add references node
-    references_node = ContextNode("references&appendix", "References", "\n".join(lines[reference_start + 1:]).strip())
+    references_node = ContextNode("references&appendix", "References", "\n".join(lines[reference_start + 1:]).strip(), store=root_node.store)
     root_node.add_child(references_node)
 
     # Finally, prepend all node ids with the root id
     root_node.prepend_node_id(root_id)
     return root_node
 
+@metrics.timed("load_unstructured")
 def load_unstructured(file_path: str):
     root_id = "".join(file_path.split("/")[-1].split(".")[0:-1]).replace(" ", "_")
     text = ""
@@ -359,7 +204,10 @@ def load_unstructured(file_path: str):
     root_node.build_tree()
     return root_node
 
+@metrics.timed("parse_by_page")
 def parse_by_page(file_path):
+    import PyPDF2
+    from tqdm import tqdm
     root_id = "".join(file_path.split("/")[-1].split(".")[0:-1]).replace(" ", "_")
     with open(file_path, "rb") as file:
         pdf_reader = PyPDF2.PdfReader(file)
@@ -369,25 +217,84 @@ def parse_by_page(file_path):
             node_id = f"p{i + 1}"
             title = f"{i + 1}"
             content = text.strip()
-            page_node = ContextNode(node_id, title, content)
+            page_node = ContextNode(node_id, title, content, store=root_node.store)
             root_node.add_child(page_node)
     root_node.prepend_node_id(root_id)
     return root_node
 
-def parse_by_TOC(file_path, contents_path):
+def load_toc(contents_path: str) -> TOCNode:
+    """
+    Load a table of contents file. It is either a list of {"title", "page", "children"} entries, or an object
+    with such a list under "contents" and an optional "page_offset" between printed and PDF page numbers.
+    """
+    with open(contents_path, "r") as contents_file:
+        toc = json.load(contents_file)
+    if isinstance(toc, list):
+        toc = {"contents": toc}
+    return TOCNode.from_dict({"children": toc.get("contents", [])}, page_offset=toc.get("page_offset", 0))
+
+def build_page_index(toc_root: TOCNode, num_pages: int):
+    """
+    Precompute the page range of every section: a section owns the pages from its first page up to the first page
+    of the next section in reading order. Returns sorted (first_page, last_page, section) intervals.
+    """
+    sections = [node for node in toc_root.flatten()[1:] if 1 <= node.page_number <= num_pages]
+    # Sort by first page, keeping reading order for sections that start on the same page
+    sections.sort(key=lambda node: node.page_number)
+    intervals = []
+    for i, section in enumerate(sections):
+        last_page = sections[i + 1].page_number - 1 if i + 1 < len(sections) else num_pages
+        intervals.append((section.page_number, max(last_page, section.page_number - 1), section))
+    return intervals
+
+@metrics.timed("parse_by_TOC")
+def parse_by_TOC(file_path, contents_path=None, word_limit=2000):
+    """
+    Parse a PDF into a context tree that follows its table of contents. If no contents file is given,
+    the outline embedded in the PDF is used. Falls back to parse_by_page when neither is available.
+    The text of a section longer than word_limit words is chunked into children placed before its subsections.
+    """
+    import PyPDF2
+    from tqdm import tqdm
     root_id = "".join(file_path.split("/")[-1].split(".")[0:-1]).replace(" ", "_")
     with open(file_path, "rb") as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        root_node = ContextNode("root", "Root", "")
-        with open(contents_path, "r") as contents_file:
-            toc = json.load(contents_file)
-            for i, page in tqdm(enumerate(pdf_reader.pages), total=len(pdf_reader.pages), desc="Processing pages"):
-                text = page.extract_text()
-                node_id = f"p_{i + 1}"
-                title = f"{i + 1}"
-                content = text.strip()
-                page_node = ContextNode(node_id, title, content)
-                root_node.add_child(page_node)
+        toc_root = load_toc(contents_path) if contents_path else TOCNode.from_outline(pdf_reader)
+        num_pages = len(pdf_reader.pages)
+        intervals = build_page_index(toc_root, num_pages)
+        if len(intervals) == 0:
+            print(f"No table of contents found for {file_path}, parsing by page")
+            return parse_by_page(file_path)
+
+        # Assign the text of every page to its section in a single pass over the pages
+        front_matter = []
+        section_texts = {}
+        interval_index = 0
+        for i, page in tqdm(enumerate(pdf_reader.pages), total=num_pages, desc="Processing pages"):
+            page_number = i + 1
+            while interval_index < len(intervals) and intervals[interval_index][1] < page_number:
+                interval_index += 1
+            text = page.extract_text().strip()
+            if interval_index < len(intervals) and intervals[interval_index][0] <= page_number:
+                section_texts.setdefault(intervals[interval_index][2].node_id, []).append(text)
+            else:
+                front_matter.append(text)
+
+    root_node = ContextNode(root_id, root_id, "")
+
+    def to_context_node(toc_node: TOCNode):
+        node = ContextNode(f"{root_id}.{toc_node.node_id}", toc_node.title, "\n".join(section_texts.get(toc_node.node_id, [])), store=root_node.store)
+        for child in toc_node.children:
+            node.add_child(to_context_node(child))
+        node.apply_word_limit(word_limit, recursive=False)
+        return node
+
+    if "".join(front_matter) != "":
+        front_matter_node = ContextNode(f"{root_id}.front_matter", "Front Matter", "\n".join(front_matter), store=root_node.store)
+        front_matter_node.apply_word_limit(word_limit, recursive=False)
+        root_node.add_child(front_matter_node)
+    for child in toc_root.children:
+        root_node.add_child(to_context_node(child))
     return root_node
 
 def main():
@@ -396,11 +303,29 @@ def main():
     parser.add_argument("-c", "--compression-ratio", type=str, default="1/4", help="The compression ratio to use")
     parser.add_argument("-o", "--output", type=str, help="The output json file")
     parser.add_argument("-u", "--unstructured", action="store_true", help="Parse the PDF file as unstructured text")
-    parser.add_argument("-t", "--toc", type=str, help="The table of contents of the PDF file in JSON formatj")
+    parser.add_argument("-t", "--toc", type=str, help="The table of contents of the PDF file in JSON format")
+    parser.add_argument("--outline", action="store_true", help="Parse the PDF file by the outline embedded in it")
     parser.add_argument("-p", "--page", action="store_true", help="Parse the PDF file by page")
     parser.add_argument("-d", "--desc", type=str, help="The description of the file to help encoder generate better summaries")
     parser.add_argument("-m", "--max-word", type=int, default=200, help="The maximum number of words in the summary")
+    parser.add_argument("-b", "--context-budget", type=int, help="Size the summaries so that each node's context fits this many tokens, instead of one compression ratio")
+    parser.add_argument("-r", "--reconstruct", action="store_true", help="Reconstruct the flat tree into a multi-level tree after summarizing")
+    parser.add_argument("--max-children", type=int, default=8, help="The maximum number of children per node when reconstructing")
+    parser.add_argument("--trace", type=str, help="Write timing spans and metrics to this JSON lines file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while encoding")
+    parser.add_argument("--usage", type=str, help="Append token usage and latency per node to this JSON lines file")
+    parser.add_argument("--transcript", type=str, help="Record LLM responses to this JSON lines file and serve them again for the same requests")
+    parser.add_argument("--transcript-mode", choices=transcript.MODES, default=transcript.AUTO, help="record, replay without calling the API, or auto")
+    parser.add_argument("--temperature", type=float, help="Sampling temperature of the API calls, 0.9 by default")
     args = parser.parse_args()
+    if args.trace is not None or args.metrics_port is not None:
+        metrics.configure(args.trace, args.metrics_port)
+    if args.usage is not None:
+        accounting.configure(args.usage)
+    if args.transcript is not None:
+        transcript.configure(args.transcript, args.transcript_mode)
+    if args.temperature is not None:
+        set_temperature(args.temperature)
 
     # Check if input is directory
     if os.path.isdir(args.input):
@@ -413,16 +338,33 @@ def main():
     for file_path in file_paths:
         if args.unstructured:
             root_node = load_unstructured(args.input)
-            root_node.apply_word_limit()
-            root_node.generate_summary(True, args.compression_ratio, True, args.desc)
+            word_limit, generate_title = 2000, True
+        elif args.toc is not None or args.outline:
+            # Sections are chunked while the tree is built, the root has no content of its own
+            root_node = parse_by_TOC(args.input, args.toc, args.max_word)
+            word_limit, generate_title = args.max_word, False
         elif args.page:
             root_node = parse_by_page(args.input)
-            root_node.apply_word_limit(args.max_word)
-            root_node.generate_summary(True, args.compression_ratio, True, args.desc)
+            word_limit, generate_title = args.max_word, True
         else:
             root_node = parse_paper(args.input)
-            root_node.apply_word_limit(args.max_word)
-            root_node.generate_summary(True, args.compression_ratio, False, args.desc)
+            word_limit, generate_title = args.max_word, False
+        with metrics.span("apply_word_limit", file=file_path):
+            root_node.apply_word_limit(word_limit)
+        planned = args.context_budget is not None
+        with metrics.span("generate_summary_tree", file=file_path), accounting.attribute(document=file_path):
+            if not planned:
+                root_node.generate_summary(True, args.compression_ratio, generate_title, args.desc)
+            elif args.reconstruct:
+                # The budgets depend on the final tree, so these summaries are only short enough to group by
+                root_node.generate_summary(True, args.compression_ratio, generate_title, args.desc, max_words=GROUPING_WORDS)
+        if args.reconstruct:
+            with metrics.span("reconstruct_tree", file=file_path), accounting.attribute(document=file_path):
+                root_node.reconstruct_tree(args.max_children, args.compression_ratio, args.desc, summarize=not planned)
+        if planned:
+            with metrics.span("summarize_with_plan", file=file_path), accounting.attribute(document=file_path):
+                plan = plan_compression(root_node, args.context_budget)
+                summarize_with_plan(root_node, plan, title=generate_title and not args.reconstruct, desc=args.desc)
 
         # Create output file path
         if args.output is not None:
@@ -435,6 +377,12 @@ def main():
 
         with open(output_file_path, "w") as file:
             file.write(root_node.to_json())
+        if args.context_budget is not None:
+            # compression_planner.py reads it to re-summarize only what a new budget changes
+            save_plan(plan, plan_path(output_file_path))
+    metrics.shutdown()
+    accounting.shutdown()
+    transcript.shutdown()
 
 if __name__ == "__main__":
     main()
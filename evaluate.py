@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import platform
+import statistics
+import time
+import metrics
+import transcript
+from api import set_backend, set_temperature
+from chat import ContextChatBot
+from context_tree import ContextNode
+from fake_llm import FakeLLM
+
+# Navigation strategies as (nodes the fake model requests at once, answer those requests with fan-out calls)
+STRATEGIES = {
+    "sequential": (1, False),
+    "wide": (3, False),
+    "fan-out": (3, True),
+}
+
+def usage_counters():
+    """
+    LLM calls and tokens so far, including replayed and fan-out calls
+    """
+    counters = metrics.snapshot()["counters"]
+    return counters.get("llm_calls", 0), counters.get("prompt_tokens", 0) + counters.get("completion_tokens", 0)
+
+def reference_recall(expected: list, references: list) -> float:
+    """
+    Fraction of the expected node ids that were referenced. A reference to a descendant, e.g. a chunk of the
+    expected node, counts as well.
+    """
+    if not expected:
+        return 1.0
+    found = [node_id for node_id in expected if any(ref == node_id or ref.startswith(node_id + ".") for ref in references)]
+    return len(found) / len(expected)
+
+def all_nodes(root_node: ContextNode) -> list:
+    nodes = []
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack += node.children
+    return nodes
+
+def encode(json_string: str, compression_ratio: str, max_words: int, chunk_words: int) -> ContextNode:
+    """
+    Rebuild the tree with the given chunk size and summary settings. With compression_ratio "stored" the tree
+    is used as it was encoded.
+    """
+    root_node = ContextNode.from_json(json_string)
+    if compression_ratio == "stored":
+        return root_node
+    if chunk_words > 0:
+        for node in all_nodes(root_node):
+            node.apply_word_limit(chunk_words)
+    root_node.generate_summary(True, compression_ratio, False, max_words=max_words)
+    return root_node
+
+class Evaluation:
+    """
+    Runs the question set against every configuration of the grid and collects one record per configuration.
+    With fake set to False the questions go to the API, or to the responses recorded in a transcript.
+    """
+    def __init__(self, questions: list, json_string: str, latency: float = 0.0, latency_per_token: float = 0.0, max_hops: int = 8,
+                 fake: bool = True):
+        self.questions = questions
+        self.json_string = json_string
+        self.fake = fake
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.max_hops = max_hops
+        self.results = []
+
+    def run(self, compression_ratio: str, max_words: int, chunk_words: int, strategies: list):
+        if self.fake:
+            set_backend(FakeLLM())
+        _, used = usage_counters()
+        with contextlib.redirect_stdout(io.StringIO()):
+            root_node = encode(self.json_string, compression_ratio, max_words, chunk_words)
+        encode_tokens = usage_counters()[1] - used
+        for strategy in strategies:
+            max_targets, fan_out = STRATEGIES[strategy]
+            if self.fake:
+                set_backend(FakeLLM(self.latency, self.latency_per_token, max_targets=max_targets))
+            recalls, hops, tokens, latencies = [], [], [], []
+            for item in self.questions:
+                chatbot = ContextChatBot(root_node, fan_out=fan_out, max_hops=self.max_hops)
+                calls, used = usage_counters()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _, _, references = chatbot.ask(item["question"])
+                latencies.append(time.perf_counter() - start)
+                hops.append(usage_counters()[0] - calls)
+                tokens.append(usage_counters()[1] - used)
+                recalls.append(reference_recall(item["references"], references))
+            self.record({
+                "compression_ratio": compression_ratio,
+                "max_words": max_words,
+                "chunk_words": chunk_words,
+                "strategy": strategy,
+                "recall": statistics.mean(recalls),
+                "hops": statistics.mean(hops),
+                "tokens": statistics.mean(tokens),
+                "latency": statistics.mean(latencies),
+                "encode_tokens": encode_tokens,
+            })
+        set_backend(None)
+
+    def record(self, result: dict):
+        self.results.append(result)
+        print(f"{result['compression_ratio']:>8} {str(result['max_words']):>6} {result['chunk_words']:>6} {result['strategy']:<12}"
+              f" {result['recall']:>7.3f} {result['hops']:>6.2f} {result['tokens']:>9.1f} {result['latency']:>9.4f} {result['encode_tokens']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality against cost over a grid of encoding and navigation settings")
+    parser.add_argument("-q", "--questions", type=str, default="eval_security.json", help="Question set with the tree it is about and the expected reference ids")
+    parser.add_argument("-t", "--tree", type=str, help="Encoded JSON tree, instead of the one named in the question set")
+    parser.add_argument("-c", "--compression-ratios", nargs="+", default=["stored", "1/8", "1/4"], help="Compression ratios, \"stored\" keeps the encoded summaries")
+    parser.add_argument("-w", "--max-words", nargs="+", type=int, default=[100, 200], help="Maximum words per summary")
+    parser.add_argument("--chunk-words", nargs="+", type=int, default=[0, 500], help="Word limits for chunking the content, 0 keeps the nodes as they are")
+    parser.add_argument("-s", "--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES), help="Navigation strategies")
+    parser.add_argument("--max-hops", type=int, default=8, help="Maximum number of LLM calls per question")
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Fake LLM latency per prompt token in seconds")
+    parser.add_argument("-b", "--backend", choices=["fake", "api"], default="fake", help="Answer with the fake LLM, or with the API and the transcript")
+    parser.add_argument("--transcript", type=str, help="Serve responses recorded in this JSON lines file, and record new ones")
+    parser.add_argument("--transcript-mode", choices=transcript.MODES, default=transcript.AUTO, help="Use replay to never call the API")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Sampling temperature of the API calls")
+    parser.add_argument("-o", "--output", type=str, default="evaluation.json", help="The output json file")
+    args = parser.parse_args()
+    # Counters are read to measure each question
+    metrics.configure()
+    set_temperature(args.temperature)
+    if args.transcript is not None:
+        transcript.configure(args.transcript, args.transcript_mode)
+
+    with open(args.questions, "r") as f:
+        question_set = json.load(f)
+    with open(args.tree or question_set["tree"], "r") as f:
+        json_string = f.read()
+
+    evaluation = Evaluation(question_set["questions"], json_string, args.latency, args.latency_per_token, args.max_hops, args.backend == "fake")
+    print(f"{'ratio':>8} {'words':>6} {'chunk':>6} {'strategy':<12} {'recall':>7} {'hops':>6} {'tokens':>9} {'latency':>9} {'encode':>10}")
+    configurations = []
+    for compression_ratio, max_words, chunk_words in itertools.product(args.compression_ratios, args.max_words, args.chunk_words):
+        if compression_ratio == "stored":
+            # The stored tree is evaluated once, as it was encoded
+            max_words, chunk_words = None, 0
+        if (compression_ratio, max_words, chunk_words) not in configurations:
+            configurations.append((compression_ratio, max_words, chunk_words))
+    for compression_ratio, max_words, chunk_words in configurations:
+        evaluation.run(compression_ratio, max_words, chunk_words, args.strategies)
+
+    output = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "questions": args.questions,
+            "tree": args.tree or question_set["tree"],
+            "latency": args.latency,
+            "latency_per_token": args.latency_per_token,
+            "backend": args.backend,
+        },
+        "results": evaluation.results,
+    }
+    transcript.shutdown()
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
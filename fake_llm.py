@@ -0,0 +1,178 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+from api import Message, prefix_hashes
+from check_token import estimate_tokens
+from llm_compressor import SYSTEM_PROMPT as COMPRESS_PROMPT, GROUP_PROMPT
+from structured_output import REPAIR_PROMPT, parse_json
+import locales
+
+ID_PATTERN = re.compile(r"""["']id["']\s*:\s*["']([^"']+)["']""")
+WORD_PATTERN = re.compile(r"[a-z]{4,}")
+STOP_WORDS = {"what", "which", "does", "that", "this", "with", "from", "about", "have", "there", "their", "they", "were", "when", "where", "paper", "document", "summary", "title", "content", "children"}
+
+class FakeLLM:
+    """
+    A local stand-in for the chat completion API with configurable latency. It recognizes the
+    encoder and chat prompts and answers with well-formed, deterministic JSON so that whole
+    pipelines can run offline. Like a server with prompt caching, it remembers the message prefixes
+    of recent calls and only charges latency_per_token for the tokens after the longest known prefix.
+    """
+    def __init__(self, latency: float = 0.0, latency_per_token: float = 0.0, max_hops: int = 3, max_targets: int = 1, prefix_cache_size: int = 256):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.max_hops = max_hops
+        self.max_targets = max_targets
+        self.calls = 0
+        # Fan-out calls arrive from worker threads
+        self.lock = threading.Lock()
+        # Prefix hash -> number of tokens in that prefix, least recently used first
+        self.prefix_cache = OrderedDict()
+        self.prefix_cache_size = prefix_cache_size
+
+    def key(self) -> str:
+        """
+        The settings that change the replies, for the transcript key. Latency only changes the timing.
+        """
+        return f"FakeLLM(max_hops={self.max_hops},max_targets={self.max_targets})"
+
+    def cached_prefix_tokens(self, messages: List[Message]) -> int:
+        """
+        Tokens in the longest message prefix seen in a recent call, then remember the prefixes of this call
+        """
+        cached_tokens = 0
+        prefix_tokens = 0
+        hashes = prefix_hashes(messages)
+        tokens = [estimate_tokens(message.content) for message in messages]
+        with self.lock:
+            for prefix_hash, message_tokens in zip(hashes, tokens):
+                prefix_tokens += message_tokens
+                if prefix_hash in self.prefix_cache:
+                    self.prefix_cache.move_to_end(prefix_hash)
+                    cached_tokens = prefix_tokens
+                elif self.prefix_cache_size > 0:
+                    self.prefix_cache[prefix_hash] = prefix_tokens
+                    if len(self.prefix_cache) > self.prefix_cache_size:
+                        self.prefix_cache.popitem(last=False)
+        return cached_tokens
+
+    def __call__(self, messages: List[Message]) -> Message:
+        with self.lock:
+            self.calls += 1
+        prompt_tokens = sum(estimate_tokens(message.content) for message in messages)
+        cached_tokens = self.cached_prefix_tokens(messages)
+        delay = self.latency + self.latency_per_token * (prompt_tokens - cached_tokens)
+        if delay > 0:
+            time.sleep(delay)
+        system_prompt = messages[0].content if messages and messages[0].role == "system" else ""
+        # The chat prompts are recognized in every locale, and their labels are read in the same locale
+        pack = locales.find_pack(system_prompt) or locales.get_pack(locales.DEFAULT_LOCALE)
+        if system_prompt == COMPRESS_PROMPT:
+            content = self.summarize(messages[-1].content)
+        elif system_prompt == GROUP_PROMPT:
+            content = self.group(messages[-1].content)
+        elif system_prompt == REPAIR_PROMPT:
+            content = self.repair(messages[-1].content)
+        elif system_prompt == pack.MAP_PROMPT:
+            content = self.map_section(messages[-1].content, pack)
+        elif system_prompt == pack.REDUCE_PROMPT:
+            content = self.reduce(messages[-1].content, pack)
+        else:
+            root_context = next((message.content for message in messages if message.content.startswith(pack.ROOT_CONTEXT_HEADER)), "")
+            content = self.navigate(messages[-1].content, root_context, pack)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(content), "cached_tokens": cached_tokens}
+        return Message("assistant", content, usage)
+
+    def summarize(self, user_prompt: str) -> str:
+        ratio_match = re.search(r"Compression ratio: (\d+)/(\d+)", user_prompt)
+        max_words_match = re.search(r"Maximum word count: (\d+)", user_prompt)
+        text = user_prompt[user_prompt.find("'''") + 3:user_prompt.rfind("'''")]
+        words = text.split()
+        limit = len(words)
+        if ratio_match:
+            limit = len(words) * int(ratio_match.group(1)) // max(1, int(ratio_match.group(2)))
+        if max_words_match:
+            limit = min(limit, int(max_words_match.group(1)))
+        summary = " ".join(words[:max(1, limit)])
+        title = " ".join(words[:6])
+        return json.dumps({"summary": summary, "title": title})
+
+    def group(self, user_prompt: str) -> str:
+        num_groups_match = re.search(r"Number of groups: (\d+)", user_prompt)
+        titles = re.findall(r"^\[(\d+)\] ([^:\n]*)", user_prompt, re.MULTILINE)
+        num_groups = int(num_groups_match.group(1)) if num_groups_match else 1
+        size = max(1, -(-len(titles) // max(1, num_groups)))
+        groups = []
+        for start in range(0, len(titles), size):
+            members = [int(index) for index, _ in titles[start:start + size]]
+            groups.append({"title": titles[start][1], "members": members})
+        return json.dumps({"groups": groups})
+
+    def repair(self, user_prompt: str) -> str:
+        """
+        Fit the reply to the expected shape that shares the most keys with it: missing keys are filled in and fixed
+        values are set. A reply without JSON goes in the first text key of the first shape.
+        """
+        shapes = [json.loads(line) for line in user_prompt[:user_prompt.find("Problems: ")].split("\n")[1:] if line.startswith("{")]
+        text = user_prompt[user_prompt.find("Reply: ") + len("Reply: "):].strip()
+        reply, _ = parse_json(text)
+        if reply is None:
+            key = next((key for key, value in shapes[0].items() if value == "..."), None)
+            reply = {key: text} if key is not None else {}
+        shape = max(shapes, key=lambda shape: len(shape.keys() & reply.keys()))
+        fixed = {key: value for key, value in shape.items() if isinstance(value, str) and value != "..."}
+        return json.dumps({**shape, **reply, **fixed})
+
+    def map_section(self, user_prompt: str, pack=None) -> str:
+        """
+        Quote the first sentence of the section's content, the section is relevant if it shares words with the question
+        """
+        pack = pack or locales.get_pack(locales.DEFAULT_LOCALE)
+        question = user_prompt[user_prompt.rfind(pack.QUESTION_LABEL):]
+        section = user_prompt[:user_prompt.rfind(pack.QUESTION_LABEL)]
+        question_words = set(WORD_PATTERN.findall(question.lower())) - STOP_WORDS
+        relevant = len(question_words & set(WORD_PATTERN.findall(section.lower()))) > 0
+        content_match = re.search(r'"(?:content|summary)":"((?:[^"\\]|\\.)*)"', section)
+        content = content_match.group(1).split(". ")[0] if relevant and content_match else ""
+        return json.dumps({"content": content, "relevant": relevant})
+
+    def reduce(self, user_prompt: str, pack=None) -> str:
+        pack = pack or locales.get_pack(locales.DEFAULT_LOCALE)
+        prefix, suffix = pack.PARTIAL_ANSWER_LABEL.split("{node_id}")
+        references = re.findall("^" + re.escape(prefix) + r"(\S+)" + re.escape(suffix.rstrip()), user_prompt, re.MULTILINE)
+        return json.dumps({"response_type": "answer", "content": "Merged answer.", "reasoning": "Fake merge.", "references": references})
+
+    def navigate(self, user_prompt: str, root_context: str = "", pack=None) -> str:
+        """
+        Request the max_targets nodes whose contexts share the most words with the question, then answer
+        after max_hops requests, when nothing relevant is left, or when the prompt says it is the final hop.
+        """
+        pack = pack or locales.get_pack(locales.DEFAULT_LOCALE)
+        question = user_prompt[user_prompt.rfind(pack.QUESTION_LABEL):]
+        question_words = set(WORD_PATTERN.findall(question.lower())) - STOP_WORDS
+        previous_match = re.search(re.escape(pack.PREVIOUS_REQUESTS_LABEL) + r"(\[.*?\])", user_prompt)
+        previous_requests = re.findall(r"""["']([^"']+)["']""", previous_match.group(1)) if previous_match else []
+        contexts_end = previous_match.start() if previous_match else len(user_prompt)
+        contexts = user_prompt[:contexts_end]
+        if ID_PATTERN.search(contexts) is None:
+            # The prompt refers to the root context sent at the start of the conversation
+            contexts = root_context
+        matches = list(ID_PATTERN.finditer(contexts))
+        scores = {}
+        for i, match in enumerate(matches):
+            node_id = match.group(1)
+            if node_id in previous_requests:
+                continue
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(contexts)
+            segment_words = set(WORD_PATTERN.findall(contexts[match.start():end].lower()))
+            score = len(question_words & segment_words)
+            if score > scores.get(node_id, 0):
+                scores[node_id] = score
+        targets = sorted(scores, key=lambda node_id: -scores[node_id])[:self.max_targets]
+        visited = [node_id for node_id in previous_requests if node_id != "root"]
+        if targets and len(visited) < self.max_hops and pack.FINAL_HOP_NOTE not in user_prompt:
+            return json.dumps({"response_type": "request", "targets": targets, "reasoning": "Most relevant nodes.", "original": True})
+        return json.dumps({"response_type": "answer", "content": "Answer based on the requested nodes.", "reasoning": "Fake answer.", "references": visited})
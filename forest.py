@@ -0,0 +1,153 @@
+import json
+from context_tree import namespaced_id
+
+SEPARATOR = ":"
+
+def namespace_dict(data: dict, namespace: str) -> dict:
+    """
+    Qualify the ids of a to_dict() tree with a namespace
+    """
+    return {
+        **data,
+        "id": namespaced_id(namespace, data["id"]),
+        "children": [namespace_dict(child, namespace) for child in data.get("children", [])],
+    }
+
+class NamespacedNode:
+    """
+    A node of a document in a DocumentForest. Behaves like the wrapped node, but shows and resolves ids in the document's namespace.
+    """
+    def __init__(self, node, namespace: str):
+        self.node = node
+        self.namespace = namespace
+
+    @property
+    def node_id(self):
+        return namespaced_id(self.namespace, self.node.node_id)
+
+    @property
+    def title(self):
+        return self.node.title
+
+    @property
+    def children(self):
+        return [NamespacedNode(child, self.namespace) for child in self.node.children]
+
+    def get_node(self, node_id: str):
+        if node_id.startswith(self.namespace + SEPARATOR):
+            node_id = node_id[len(self.namespace) + len(SEPARATOR):]
+        node = self.node.get_node(node_id)
+        return NamespacedNode(node, self.namespace) if node is not None else None
+
+    def get_context(self, depth: int = 0, original: bool = False):
+        return self.node.get_context(depth, original, self.namespace)
+
+    def render_context(self, depth: int = 0, original: bool = False) -> str:
+        return self.node.render_context(depth, original, self.namespace)
+
+    def write_context(self, buffer, depth: int = 0, original: bool = False):
+        buffer.write(self.render_context(depth, original))
+
+    def to_dict(self):
+        return namespace_dict(self.node.to_dict(), self.namespace)
+
+class DocumentForest:
+    """
+    Several documents under one virtual root. Each document gets a unique namespace, and ids are shown as
+    "<namespace>:<id>" unless they already start with the namespace. Ids are resolved through the table of
+    namespaces, so adding or removing a document does not touch the ids or caches of the other documents.
+    """
+    def __init__(self, node_id: str = "root", title: str = ""):
+        self.node_id = node_id
+        self.title = title
+        # Namespace -> document root, in the order the documents were added
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, root_node, namespace: str = None) -> str:
+        """
+        Add a document (a ContextNode or a stored document) and return its namespace, which is the root id
+        unless that is taken
+        """
+        base = (namespace or root_node.node_id or "doc").replace(SEPARATOR, "_")
+        namespace = base
+        suffix = 2
+        while namespace in self.documents:
+            namespace = f"{base}_{suffix}"
+            suffix += 1
+        self.documents[namespace] = root_node
+        return namespace
+
+    def remove(self, namespace: str):
+        return self.documents.pop(namespace, None)
+
+    @property
+    def children(self):
+        return [NamespacedNode(root_node, namespace) for namespace, root_node in self.documents.items()]
+
+    def resolve(self, node_id: str):
+        """
+        The namespace and document id of a forest id, or None if no document has that namespace
+        """
+        if SEPARATOR in node_id:
+            namespace, local_id = node_id.split(SEPARATOR, 1)
+            if namespace in self.documents:
+                return namespace, local_id
+        # Ids that start with the namespace are shown unqualified, try the longest matching namespace first
+        parts = node_id.split(".")
+        for i in range(len(parts), 0, -1):
+            namespace = ".".join(parts[:i])
+            if namespace in self.documents:
+                return namespace, node_id
+        return None
+
+    def get_node(self, node_id: str):
+        if node_id == self.node_id:
+            return self
+        resolved = self.resolve(node_id)
+        if resolved is not None:
+            namespace, local_id = resolved
+            node = self.documents[namespace].get_node(local_id)
+            return NamespacedNode(node, namespace) if node is not None else None
+        # An id without its namespace, e.g. dropped by the model, resolves to the first document that has it
+        for namespace, root_node in self.documents.items():
+            node = root_node.get_node(node_id)
+            if node is not None:
+                return NamespacedNode(node, namespace)
+        return None
+
+    def get_context(self, depth: int = 0, original: bool = False):
+        context = {"id": self.node_id, "title": self.title}
+        if self.documents:
+            context["children"] = [child.get_context(depth - 1) for child in self.children]
+        return context
+
+    def render_context(self, depth: int = 0, original: bool = False) -> str:
+        """
+        Compact JSON of get_context(depth). Only the documents' own renderings are cached, so they stay valid
+        when documents are added or removed.
+        """
+        parts = ['{"id":', json.dumps(self.node_id, ensure_ascii=False), ',"title":', json.dumps(self.title, ensure_ascii=False)]
+        if self.documents:
+            parts.append(',"children":[')
+            parts.append(",".join(child.render_context(depth - 1) for child in self.children))
+            parts.append("]")
+        parts.append("}")
+        return "".join(parts)
+
+    def write_context(self, buffer, depth: int = 0, original: bool = False):
+        buffer.write(self.render_context(depth, original))
+
+    def to_dict(self):
+        return {
+            "id": self.node_id,
+            "title": self.title,
+            "content": "",
+            "summary": "",
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def to_json(self, indent=4):
+        return json.dumps(self.to_dict(), indent=indent)
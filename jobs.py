@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import accounting
+from context_tree import ContextNode
+from encoder import load_unstructured
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    file_hash TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    nodes_done INTEGER NOT NULL DEFAULT 0,
+    nodes_total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobQueue:
+    """
+    Encodes uploaded files in a pool of worker threads. Jobs are kept in a SQLite table and identified by the
+    hash of the file, so uploading the same file again returns the existing job and its cached result.
+    Uploads and results are stored in cache_dir.
+    """
+    def __init__(self, cache_dir: str = ".cac_cache", workers: int = 2, word_limit: int = 2000, compression_ratio: str = "1/4"):
+        self.cache_dir = cache_dir
+        self.word_limit = word_limit
+        self.compression_ratio = compression_ratio
+        os.makedirs(os.path.join(cache_dir, "uploads"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "results"), exist_ok=True)
+        self.path = os.path.join(cache_dir, "jobs.db")
+        self.lock = threading.Lock()
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+        self.resume()
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection per call, so that the workers and the UI thread never share one
+        return sqlite3.connect(self.path, timeout=30)
+
+    def upload_path(self, file_hash: str, name: str) -> str:
+        # The file keeps its name, which load_unstructured uses as the root id and title
+        return os.path.join(self.cache_dir, "uploads", file_hash, os.path.basename(name))
+
+    def result_path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, "results", file_hash + ".json")
+
+    def submit(self, name: str, data: bytes, retry: bool = False) -> int:
+        """
+        Queue a PDF or TXT file for encoding and return the job id. A file that is already queued, running
+        or encoded is not encoded again, and one that failed only if retry is set.
+        """
+        file_hash = hashlib.sha256(data).hexdigest()
+        with self.lock, self.connect() as connection:
+            row = connection.execute("SELECT job_id, status FROM jobs WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row is not None and (row[1] in (QUEUED, RUNNING) or (row[1] == FAILED and not retry)
+                                    or (row[1] == DONE and os.path.isfile(self.result_path(file_hash)))):
+                return row[0]
+            upload_path = self.upload_path(file_hash, name)
+            os.makedirs(os.path.dirname(upload_path), exist_ok=True)
+            with open(upload_path, "wb") as f:
+                f.write(data)
+            now = time.time()
+            if row is None:
+                job_id = connection.execute(
+                    "INSERT INTO jobs (file_hash, name, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                    (file_hash, name, QUEUED, now, now)).lastrowid
+            else:
+                job_id = row[0]
+                connection.execute(
+                    "UPDATE jobs SET name = ?, status = ?, nodes_done = 0, nodes_total = 0, error = NULL, updated = ? WHERE job_id = ?",
+                    (name, QUEUED, now, job_id))
+        self.executor.submit(self.run, job_id)
+        return job_id
+
+    def resume(self):
+        """
+        Queue again the jobs that were left unfinished when the previous process stopped
+        """
+        with self.connect() as connection:
+            job_ids = [row[0] for row in connection.execute("SELECT job_id FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING))]
+        for job_id in job_ids:
+            self.executor.submit(self.run, job_id)
+
+    def update(self, job_id: int, **fields):
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.connect() as connection:
+            connection.execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE job_id = ?", (*fields.values(), time.time(), job_id))
+
+    def get(self, job_id: int) -> dict:
+        with self.connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_jobs(self) -> list:
+        with self.connect() as connection:
+            connection.row_factory = sqlite3.Row
+            return [dict(row) for row in connection.execute("SELECT * FROM jobs ORDER BY job_id")]
+
+    def run(self, job_id: int):
+        job = self.get(job_id)
+        if job is None or job["status"] == DONE:
+            return
+        self.update(job_id, status=RUNNING, nodes_done=0, nodes_total=0)
+        try:
+            with accounting.attribute(document=job["name"]):
+                root_node = load_unstructured(self.upload_path(job["file_hash"], job["name"]))
+                root_node.apply_word_limit(self.word_limit)
+                nodes_total = count_nodes(root_node)
+                self.update(job_id, nodes_total=nodes_total)
+                nodes_done = 0
+                def progress(node):
+                    nonlocal nodes_done
+                    nodes_done += 1
+                    self.update(job_id, nodes_done=nodes_done)
+                root_node.generate_summary(True, self.compression_ratio, title=True, progress=progress)
+            # Write to a temporary name first so that a result file is never seen half written
+            result_path = self.result_path(job["file_hash"])
+            with open(result_path + ".tmp", "w") as f:
+                f.write(root_node.to_json())
+            os.replace(result_path + ".tmp", result_path)
+            self.update(job_id, status=DONE)
+        except Exception as e:
+            self.update(job_id, status=FAILED, error=f"{type(e).__name__}: {e}")
+
+    def load_result(self, job_id: int) -> ContextNode:
+        """
+        The encoded tree of a finished job, read from the cache
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] != DONE:
+            return None
+        with open(self.result_path(job["file_hash"]), "r") as f:
+            return ContextNode.from_json(f.read())
+
+    def wait(self, job_id: int, interval: float = 1.0) -> dict:
+        job = self.get(job_id)
+        while job["status"] in (QUEUED, RUNNING):
+            time.sleep(interval)
+            job = self.get(job_id)
+        return job
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+def count_nodes(root_node: ContextNode) -> int:
+    count = 0
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack += node.children
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode files in the background job queue used by the Streamlit app")
+    parser.add_argument("files", nargs="*", help="PDF or TXT files to encode")
+    parser.add_argument("--cache-dir", type=str, default=".cac_cache", help="Directory of the job table, uploads and results")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Number of worker threads")
+    args = parser.parse_args()
+
+    job_queue = JobQueue(args.cache_dir, args.workers)
+    for file_path in args.files:
+        with open(file_path, "rb") as f:
+            job_id = job_queue.submit(os.path.basename(file_path), f.read(), retry=True)
+        print(f"{file_path}: job {job_id}")
+    job_queue.shutdown()
+    for job in job_queue.list_jobs():
+        print(f"{job['job_id']:>5} {job['status']:<8} {job['nodes_done']:>5}/{job['nodes_total']:<5} {job['name']} {job['error'] or ''}")
+
+if __name__ == "__main__":
+    main()
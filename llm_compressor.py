@@ -1,6 +1,7 @@
-import json
-from typing import Tuple
+from typing import List, Tuple
+import metrics
 from api import Message, send_messages
+from structured_output import parse_structured, SUMMARY_SCHEMA, GROUP_SCHEMA
 
 
 SYSTEM_PROMPT = """
@@ -23,6 +24,28 @@ Assistant:
 {"summary": "Example summary", "title": "Example title"}
 """
 
+GROUP_PROMPT = """
+You will be given a numbered list of sections of a document, each with a title and a summary. Think about this step by step:
+- User will specify the number of groups and the maximum number of sections in each group, and describe the document.
+- Group the sections by topic so that each group covers one coherent part of the document.
+- Every section number must appear in exactly one group. Keep the numbers of each group in ascending order.
+- Prefer keeping neighbouring sections together when they are about the same topic.
+- Generate a short title for each group that describes its sections.
+- You MUST output the groups in JSON format.
+Example:
+User:
+Description: A research paper on the topic of NLP.
+Number of groups: 2
+Maximum sections per group: 3
+Sections:
+[0] Introduction: Example summary
+[1] Background: Example summary
+[2] Method: Example summary
+[3] Results: Example summary
+Assistant:
+{"groups": [{"title": "Motivation and background", "members": [0, 1]}, {"title": "Method and evaluation", "members": [2, 3]}]}
+"""
+
 def compress(text, compression_ratio: str = "1/4", max_words: int = "200", desc: str = "document") -> Tuple[str, str]:
     system_messages = [Message("system", SYSTEM_PROMPT)]
     user_prompt = f"Description: {desc}\n"
@@ -33,13 +56,48 @@ def compress(text, compression_ratio: str = "1/4", max_words: int = "200", desc:
         Message("user", user_prompt),
     ]
     messages = system_messages + user_messages
-    response_message = send_messages(messages)
-    if "{" not in response_message.content or "}" not in response_message.content:
-        summary = response_message.content
+    with metrics.span("compress", words=len(text.split())):
+        response_message = send_messages(messages)
+    # A reply that cannot be repaired locally gets one repair call, which is much cheaper than summarizing again
+    response_json = parse_structured(response_message.content, SUMMARY_SCHEMA, send=send_messages)
+    if response_json is None:
+        # The raw reply is not a summary, the node is left without one
+        metrics.incr("compress_invalid_json")
+        summary = ""
         title = ""
     else:
-        # Find the first { and last } to get the JSON
-        response_json = json.loads(response_message.content[response_message.content.find("{"):response_message.content.rfind("}")+1])
         summary = response_json["summary"]
-        title = response_json["title"]
-    return title, summary
\ No newline at end of file
+        title = response_json.get("title", "")
+    return title, summary
+
+def group(sections: List[Tuple[str, str]], num_groups: int, max_members: int, desc: str = "document") -> List[Tuple[str, List[int]]]:
+    """
+    Cluster sections, given as (title, summary) pairs, into titled groups with a single LLM call.
+    Returns the raw (title, members) pairs; callers are responsible for validating the partition.
+    """
+    system_messages = [Message("system", GROUP_PROMPT)]
+    user_prompt = f"Description: {desc}\n"
+    user_prompt += f"Number of groups: {num_groups}\n"
+    user_prompt += f"Maximum sections per group: {max_members}\n"
+    user_prompt += "Sections:\n"
+    for i, (title, summary) in enumerate(sections):
+        user_prompt += f"[{i}] {title}: {summary}\n"
+    messages = system_messages + [Message("user", user_prompt)]
+    with metrics.span("group", sections=len(sections), groups=num_groups):
+        response_message = send_messages(messages)
+    # No repair call, an unusable grouping falls back to contiguous groups
+    response_json = parse_structured(response_message.content, GROUP_SCHEMA)
+    if response_json is None:
+        metrics.incr("group_invalid_json")
+        return []
+    groups = []
+    for g in response_json.get("groups", []):
+        if not isinstance(g, dict):
+            continue
+        members = g.get("members")
+        if not isinstance(members, list):
+            continue
+        # bool is an int subclass, true is not section 1
+        members = [m for m in members if isinstance(m, int) and not isinstance(m, bool)]
+        groups.append((str(g.get("title", "")), members))
+    return groups
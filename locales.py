@@ -0,0 +1,33 @@
+import importlib
+import re
+
+# Module with the prompts of each locale. A pack is only imported the first time its locale is used.
+PACKS = {"en": "prompts_en", "zh": "prompts_zh"}
+DEFAULT_LOCALE = "en"
+
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+LATIN_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+def get_pack(locale: str):
+    if locale not in PACKS:
+        raise ValueError(f"Unknown locale {locale}, expected one of {list(PACKS)}")
+    return importlib.import_module(PACKS[locale])
+
+def detect_language(text: str) -> str:
+    """
+    "zh" if the text has at least as many Chinese characters as Latin words, else the default locale
+    """
+    cjk_characters = len(CJK_PATTERN.findall(text))
+    if cjk_characters > 0 and cjk_characters >= len(LATIN_WORD_PATTERN.findall(text)):
+        return "zh"
+    return DEFAULT_LOCALE
+
+def find_pack(system_prompt: str):
+    """
+    The pack that defines the given system, map or reduce prompt, or None
+    """
+    for locale in PACKS:
+        pack = get_pack(locale)
+        if system_prompt in (pack.SYSTEM_PROMPT, pack.MAP_PROMPT, pack.REDUCE_PROMPT):
+            return pack
+    return None
@@ -0,0 +1,171 @@
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Instrumentation is off until configure() is called, so spans and counters cost a single check
+enabled = False
+_lock = threading.Lock()
+_trace_file = None
+_counters = defaultdict(float)
+_durations = defaultdict(float)
+_span_counts = defaultdict(int)
+_local = threading.local()
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """
+    Times a block of code. Spans nest per thread, and each finished span is written to the trace file.
+    """
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.perf_start
+        _local.stack.pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        with _lock:
+            _durations[self.name] += duration
+            _span_counts[self.name] += 1
+        write_event({"type": "span", "name": self.name, "parent": self.parent, "start": self.start, "duration": duration, **self.attributes})
+        return False
+
+    def set(self, **attributes):
+        """
+        Attach attributes that are only known once the block has run
+        """
+        self.attributes.update(attributes)
+
+def span(name: str, **attributes):
+    """
+    Time a stage, e.g. `with metrics.span("generate_summary", node=node_id):`
+    """
+    if not enabled:
+        return _NULL_SPAN
+    return Span(name, attributes)
+
+def timed(name: str):
+    """
+    Decorator that wraps every call of a function in a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def incr(name: str, value: float = 1):
+    """
+    Add to a counter such as llm_calls or prompt_tokens
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] += value
+
+def write_event(event: dict):
+    if _trace_file is None:
+        return
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        _trace_file.write(line)
+        _trace_file.flush()
+
+def snapshot() -> dict:
+    """
+    Current counters, and total time and count per span name
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "spans": {name: {"count": _span_counts[name], "seconds": _durations[name]} for name in _durations},
+        }
+
+def prometheus_text() -> str:
+    """
+    Render the metrics in the Prometheus text exposition format
+    """
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"# TYPE cac_{name}_total counter")
+        lines.append(f"cac_{name}_total {value}")
+    lines.append("# TYPE cac_span_seconds_total counter")
+    for name, span_data in sorted(data["spans"].items()):
+        lines.append(f'cac_span_seconds_total{{span="{name}"}} {span_data["seconds"]}')
+    lines.append("# TYPE cac_span_count_total counter")
+    for name, span_data in sorted(data["spans"].items()):
+        lines.append(f'cac_span_count_total{{span="{name}"}} {span_data["count"]}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_prometheus(port: int) -> HTTPServer:
+    """
+    Serve /metrics in the Prometheus text format from a background thread
+    """
+    server = HTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure(trace_path: str = None, prometheus_port: int = None):
+    """
+    Enable instrumentation. Spans are appended to trace_path as JSON lines, and metrics are served
+    on prometheus_port if given. Counters are collected in memory either way.
+    """
+    global enabled, _trace_file
+    enabled = True
+    if trace_path is not None:
+        _trace_file = open(trace_path, "a")
+    if prometheus_port is not None:
+        serve_prometheus(prometheus_port)
+
+def shutdown():
+    """
+    Write the final counters to the trace file and close it
+    """
+    global enabled, _trace_file
+    if _trace_file is not None:
+        write_event({"type": "metrics", "time": time.time(), **snapshot()})
+        _trace_file.close()
+        _trace_file = None
+    enabled = False
@@ -0,0 +1,284 @@
+import json
+import re
+from typing import List, Tuple
+import metrics
+from api import Message
+
+REPAIR_PROMPT = """
+You fix malformed JSON. The user gives a reply that should have been a JSON object of one of the expected shapes,
+and the problems found in it. Reply with only the corrected JSON object. Keep the values of the original reply,
+only change what is needed to match the expected shape.
+"""
+
+# A schema maps each key to (type, required). A string instead of a type means the value must be that string.
+SUMMARY_SCHEMA = {"summary": (str, True), "title": (str, False)}
+GROUP_SCHEMA = {"groups": (list, True)}
+REQUEST_SCHEMA = {"response_type": ("request", True), "targets": (list, True), "reasoning": (str, False), "original": (bool, False)}
+ANSWER_SCHEMA = {"response_type": ("answer", True), "content": (str, True), "reasoning": (str, False), "references": (list, False)}
+CHAT_SCHEMAS = [REQUEST_SCHEMA, ANSWER_SCHEMA]
+MAP_SCHEMA = {"content": (str, True), "relevant": (bool, False)}
+
+NUMBER_PATTERN = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+WORD_CHARACTERS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.+-")
+LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+class JSONStreamParser:
+    """
+    Reads the first JSON object of a model reply from chunks of text, and rewrites it into strict JSON as it goes.
+    Text around the object is ignored. Single quotes, Python literals, unquoted words, raw newlines and stray quotes
+    in strings, and trailing commas are fixed on the way, and close() completes an object that was cut off.
+    """
+    def __init__(self):
+        self.pending = ""
+        self.output = []
+        # Open containers as [bracket, output length after the last separator, whether the member has a colon]
+        self.stack = []
+        self.quote = None
+        self.escape = False
+        self.started = False
+        self.done = False
+        self.repaired = False
+
+    def feed(self, chunk: str):
+        self.pending += chunk
+        self.scan(final=False)
+
+    def emit(self, text: str):
+        self.output.append(text)
+
+    def strip_output(self, characters: str):
+        while self.output and len(self.output[-1]) == 1 and self.output[-1] in characters:
+            if self.output[-1] == ",":
+                self.repaired = True
+            self.output.pop()
+
+    def scan(self, final: bool):
+        text = self.pending
+        i = 0
+        while i < len(text) and not self.done:
+            c = text[i]
+            if not self.started:
+                if c == "{":
+                    self.started = True
+                    self.open(c)
+                i += 1
+            elif self.quote is not None:
+                if self.escape:
+                    self.escape = False
+                    if c == "'":
+                        # \' is not a JSON escape
+                        self.output[-1] = "'"
+                    elif c not in '"\\/bfnrtu':
+                        self.output[-1] = "\\\\"
+                        self.emit(c)
+                        self.repaired = True
+                    else:
+                        self.emit(c)
+                elif c == "\\":
+                    self.escape = True
+                    self.emit(c)
+                elif c == self.quote:
+                    # A quote ends the string only if a separator follows, otherwise it is part of the text
+                    j = i + 1
+                    while j < len(text) and text[j].isspace():
+                        j += 1
+                    if j == len(text) and not final:
+                        break
+                    if j == len(text) or text[j] in ",:}]":
+                        self.emit('"')
+                        self.quote = None
+                    else:
+                        self.emit('\\"' if c == '"' else c)
+                        self.repaired = True
+                elif c == '"':
+                    self.emit('\\"')
+                elif c < " ":
+                    self.emit(json.dumps(c)[1:-1])
+                    self.repaired = True
+                else:
+                    self.emit(c)
+                i += 1
+            elif c in "\"'":
+                self.quote = c
+                self.repaired = self.repaired or c == "'"
+                self.emit('"')
+                i += 1
+            elif c in "{[":
+                self.open(c)
+                i += 1
+            elif c in "}]":
+                self.close_container(c)
+                i += 1
+            elif c == ",":
+                self.emit(c)
+                self.stack[-1][1:] = [len(self.output), False]
+                i += 1
+            elif c == ":":
+                self.emit(c)
+                self.stack[-1][2] = True
+                i += 1
+            elif c.isspace():
+                self.emit(c)
+                i += 1
+            elif c in WORD_CHARACTERS:
+                j = i
+                while j < len(text) and text[j] in WORD_CHARACTERS:
+                    j += 1
+                if j == len(text) and not final:
+                    break
+                self.emit_word(text[i:j])
+                i = j
+            else:
+                # Stray characters between values, e.g. a comment or a code fence
+                self.repaired = True
+                i += 1
+        self.pending = text[i:]
+
+    def open(self, bracket: str):
+        self.emit(bracket)
+        self.stack.append([bracket, len(self.output), False])
+
+    def close_container(self, bracket: str):
+        self.strip_output(", \n\r\t")
+        expected = CLOSERS[self.stack[-1][0]]
+        if bracket != expected:
+            self.repaired = True
+        self.emit(expected)
+        self.stack.pop()
+        if not self.stack:
+            self.done = True
+
+    def emit_word(self, word: str):
+        if word in LITERALS:
+            self.repaired = self.repaired or LITERALS[word] != word
+            self.emit(LITERALS[word])
+        elif NUMBER_PATTERN.fullmatch(word):
+            self.emit(word)
+        else:
+            self.emit(json.dumps(word))
+            self.repaired = True
+
+    def close(self) -> Tuple[dict, bool]:
+        """
+        The parsed object and whether it had to be repaired, or (None, False) if there is no usable object
+        """
+        self.scan(final=True)
+        if not self.started:
+            return None, False
+        if not self.done:
+            # The reply was cut off, close the open string and containers
+            self.repaired = True
+            if self.quote is not None:
+                if self.escape:
+                    self.output.pop()
+                self.emit('"')
+                self.quote = None
+            while self.stack:
+                bracket, separator, colon = self.stack[-1]
+                self.strip_output(", \n\r\t")
+                if bracket == "{" and not colon:
+                    # Drop a key without a value
+                    del self.output[separator:]
+                    self.strip_output(", \n\r\t")
+                elif self.output[-1] == ":":
+                    self.emit("null")
+                self.close_container(CLOSERS[bracket])
+        try:
+            value = json.loads("".join(self.output))
+        except json.JSONDecodeError:
+            return None, False
+        return (value, self.repaired) if isinstance(value, dict) else (None, False)
+
+def parse_json(text: str) -> Tuple[dict, bool]:
+    """
+    The first JSON object in text and whether it had to be repaired, or (None, False)
+    """
+    parser = JSONStreamParser()
+    parser.feed(text)
+    return parser.close()
+
+def coerce(value, expected):
+    """
+    Convert a value to the expected type where the intent is clear, or return None
+    """
+    if isinstance(expected, str):
+        return expected if isinstance(value, str) and value.strip().lower() == expected else None
+    if isinstance(value, expected):
+        return value
+    if expected is list and isinstance(value, str):
+        return [value]
+    if expected is bool and isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    if expected is str and isinstance(value, (int, float, bool)):
+        return str(value)
+    if expected is str and isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return "\n".join(value)
+    return None
+
+def validate(value: dict, schema: dict) -> Tuple[dict, List[str]]:
+    """
+    Check a parsed object against a schema. Returns the object with coerced values, and the problems left.
+    """
+    result = dict(value)
+    errors = []
+    for key, (expected, required) in schema.items():
+        if key not in value:
+            if isinstance(expected, str) and all(k in value for k, (_, r) in schema.items() if r and k != key):
+                # The other required keys identify the shape
+                result[key] = expected
+            elif required:
+                errors.append(f'missing key "{key}"')
+            continue
+        coerced = coerce(value[key], expected)
+        if coerced is None:
+            errors.append(f'"{key}" should be {json.dumps(expected) if isinstance(expected, str) else expected.__name__}')
+        elif expected is list:
+            result[key] = [item if isinstance(item, (str, int, dict)) else str(item) for item in coerced]
+        else:
+            result[key] = coerced
+    return result, errors
+
+def example(schema: dict) -> str:
+    values = {str: "...", list: [], bool: True}
+    return json.dumps({key: expected if isinstance(expected, str) else values[expected] for key, (expected, _) in schema.items()})
+
+def parse_and_validate(content: str, schemas: List[dict]) -> Tuple[dict, List[str]]:
+    value, repaired = parse_json(content)
+    if value is None:
+        return None, ["the reply is not a JSON object"]
+    best = None
+    for schema in schemas:
+        result, errors = validate(value, schema)
+        if not errors:
+            if repaired or result != value:
+                metrics.incr("json_local_repairs")
+            return result, []
+        if best is None or len(errors) < len(best[1]):
+            best = (result, errors)
+    return best
+
+def parse_structured(content: str, schemas, send=None) -> dict:
+    """
+    Parse a model reply into an object matching one of the schemas. Local repairs are tried first. If the reply
+    is still unusable and send is given, send(messages) is called once to have the model fix it.
+    Returns None if no valid object could be obtained.
+    """
+    if isinstance(schemas, dict):
+        schemas = [schemas]
+    value, errors = parse_and_validate(content, schemas)
+    if not errors:
+        return value
+    if send is not None:
+        metrics.incr("json_repair_calls")
+        metrics.incr("llm_retries")
+        user_prompt = "Expected shapes:\n" + "\n".join(example(schema) for schema in schemas) + "\n"
+        user_prompt += f"Problems: {'; '.join(errors)}\n"
+        user_prompt += f"Reply: {content}\n"
+        with metrics.span("json_repair", errors=len(errors)):
+            response_message = send([Message("system", REPAIR_PROMPT), Message("user", user_prompt)])
+        value, errors = parse_and_validate(response_message.content, schemas)
+        if not errors:
+            return value
+    metrics.incr("json_invalid")
+    return None
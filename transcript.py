@@ -0,0 +1,75 @@
+import json
+import threading
+
+RECORD = "record"
+REPLAY = "replay"
+AUTO = "auto"
+MODES = [RECORD, REPLAY, AUTO]
+
+_lock = threading.Lock()
+_log_file = None
+_mode = None
+# Key -> recorded responses in the order they were recorded, and how many of them were served so far
+_responses = {}
+_served = {}
+
+def configure(log_path: str, mode: str = AUTO):
+    """
+    Record LLM responses to log_path as JSON lines keyed by the hash of the request, and/or serve them from it.
+    record: always call the backend and append the response. replay: only serve recorded responses, a request
+    that was not recorded is an error. auto: serve recorded responses and record the others.
+    """
+    global _log_file, _mode
+    if mode not in MODES:
+        raise ValueError(f"Unknown transcript mode {mode}, expected one of {MODES}")
+    _responses.clear()
+    _served.clear()
+    try:
+        with open(log_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    _responses.setdefault(entry["key"], []).append(entry)
+    except FileNotFoundError:
+        pass
+    _mode = mode
+    _log_file = open(log_path, "a") if mode != REPLAY else None
+
+def shutdown():
+    global _log_file, _mode
+    if _log_file is not None:
+        _log_file.close()
+        _log_file = None
+    _mode = None
+
+def enabled() -> bool:
+    return _mode is not None
+
+def lookup(key: str) -> dict:
+    """
+    The recorded response for a request as {"role", "content", "usage"}, or None if it has to be sent.
+    A request made several times gets its recorded responses in order, then the last one again.
+    """
+    if _mode is None or _mode == RECORD:
+        return None
+    with _lock:
+        responses = _responses.get(key)
+        if not responses:
+            if _mode == REPLAY:
+                raise LookupError(f"No recorded response for request {key[:12]} in replay mode")
+            return None
+        index = min(_served.get(key, 0), len(responses) - 1)
+        _served[key] = index + 1
+        return responses[index]
+
+def record(key: str, role: str, content: str, usage: dict):
+    if _log_file is None:
+        return
+    entry = {"key": key, "role": role, "content": content, "usage": usage}
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    with _lock:
+        _responses.setdefault(key, []).append(entry)
+        # Responses recorded in this run count as served, so a repeated request gets its next response
+        _served[key] = _served.get(key, 0) + 1
+        _log_file.write(line)
+        _log_file.flush()
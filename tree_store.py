@@ -0,0 +1,260 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+NODE_ID = 0
+TITLE = 1
+CONTENT = 2
+SUMMARY = 3
+FIELDS = 4
+# Title, content and summary are slices of the buffer, ids are kept as prefix-compressed entries
+TEXT_FIELDS = 3
+# Offsets are 32-bit until the buffer outgrows them
+OFFSET_LIMIT = 1 << 32
+# Rewrite the text buffer once this many bytes, and at least half of it, are left over from replaced texts
+COMPACT_THRESHOLD = 1 << 20
+# Ids added or changed since the id index was sorted are scanned linearly until there are more than this many
+INDEX_BATCH = 256
+
+class TreeStore:
+    """
+    Struct-of-arrays storage for context trees. Nodes are integer indices into parallel arrays, and the
+    title, content and summary of every node are slices of one shared UTF-8 buffer. An id is an entry that
+    extends the id of an earlier entry with a suffix, e.g. "doc.3.chunk_2" is "doc.3" plus ".chunk_2", and equal
+    ids share an entry. Entries are never changed, a renamed node gets a new one. Ids are looked up through
+    a sorted array of id hashes that is built on the first lookup. ContextNode objects are lightweight views of (store, index).
+    """
+    def __init__(self):
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.last_child = array("i")
+        self.next_sibling = array("i")
+        # TEXT_FIELDS (offset, length) slices of the buffer per node
+        self.text_offsets = array("I")
+        self.text_lengths = array("I")
+        self.buffer = bytearray()
+        self.garbage = 0
+        # The id entry of every node, and per entry the entry it extends (or -1) and the slice of its suffix
+        self.id_entries = array("i")
+        self.entry_prefixes = array("i")
+        self.entry_offsets = array("I")
+        self.entry_lengths = array("I")
+        # Sorted 32-bit hashes of node ids and the matching node indices, plus the nodes added or renamed since
+        self.id_hashes = array("I")
+        self.id_nodes = array("i")
+        self.unindexed = array("i")
+        # Rendered contexts per node, see ContextNode.render_context
+        self.context_cache = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add_node(self, node_id: str, title: str = "", content: str = "", summary: str = "") -> int:
+        index = len(self.parent)
+        # Trees are built parent first, so the previous node's id usually has a prefix of this one
+        self.id_entries.append(self.id_entry(node_id, self.id_entries[index - 1] if index > 0 else -1))
+        for links in (self.parent, self.first_child, self.last_child, self.next_sibling):
+            links.append(-1)
+        for text in (title, content, summary):
+            data = text.encode("utf-8", "surrogatepass")
+            self.text_offsets.append(self.append_data(data))
+            self.text_lengths.append(len(data))
+        self.unindexed.append(index)
+        return index
+
+    def append_data(self, data: bytes) -> int:
+        """
+        Append bytes to the buffer and return their offset
+        """
+        offset = len(self.buffer)
+        if offset + len(data) >= OFFSET_LIMIT and self.text_offsets.typecode == "I":
+            self.text_offsets = array("Q", self.text_offsets)
+            self.entry_offsets = array("Q", self.entry_offsets)
+        self.buffer += data
+        return offset
+
+    def entry_bytes(self, entry: int) -> bytes:
+        parts = []
+        while entry != -1:
+            offset = self.entry_offsets[entry]
+            parts.append(self.buffer[offset:offset + self.entry_lengths[entry]])
+            entry = self.entry_prefixes[entry]
+        return b"".join(reversed(parts))
+
+    def id_entry(self, node_id: str, near: int) -> int:
+        """
+        The entry for node_id. It extends the longest entry on the chain of near whose id is a prefix of node_id,
+        or is that entry if the ids are equal.
+        """
+        data = node_id.encode("utf-8", "surrogatepass")
+        prefix, prefix_length = -1, 0
+        if near != -1:
+            full = self.entry_bytes(near)
+            length = len(full)
+            entry = near
+            while entry != -1 and length > 0:
+                if data.startswith(full[:length]):
+                    if length == len(data):
+                        return entry
+                    prefix, prefix_length = entry, length
+                    break
+                length -= self.entry_lengths[entry]
+                entry = self.entry_prefixes[entry]
+        suffix = data[prefix_length:]
+        self.entry_prefixes.append(prefix)
+        self.entry_offsets.append(self.append_data(suffix))
+        self.entry_lengths.append(len(suffix))
+        return len(self.entry_prefixes) - 1
+
+    def get_text(self, index: int, field: int) -> str:
+        if field == NODE_ID:
+            return self.get_id(index)
+        slot = index * TEXT_FIELDS + field - 1
+        offset = self.text_offsets[slot]
+        return self.buffer[offset:offset + self.text_lengths[slot]].decode("utf-8", "surrogatepass")
+
+    def get_id(self, index: int) -> str:
+        return self.entry_bytes(self.id_entries[index]).decode("utf-8", "surrogatepass")
+
+    def set_text(self, index: int, field: int, text: str):
+        if field == NODE_ID:
+            self.set_id(index, text)
+            return
+        slot = index * TEXT_FIELDS + field - 1
+        data = text.encode("utf-8", "surrogatepass")
+        length = self.text_lengths[slot]
+        if len(data) <= length:
+            # Overwrite in place, the tail of the old text becomes garbage
+            offset = self.text_offsets[slot]
+            self.buffer[offset:offset + len(data)] = data
+            self.garbage += length - len(data)
+        else:
+            self.text_offsets[slot] = self.append_data(data)
+            self.garbage += length
+        self.text_lengths[slot] = len(data)
+        if self.garbage > COMPACT_THRESHOLD and self.garbage * 2 > len(self.buffer):
+            self.compact()
+        self.invalidate(index)
+
+    def set_id(self, index: int, node_id: str):
+        # Renames usually go from the root down, so the parent's id is the likely prefix. The old entry is kept,
+        # other ids may extend it. The old id stays in the index and is skipped by find because it no longer matches.
+        parent = self.parent[index]
+        self.id_entries[index] = self.id_entry(node_id, self.id_entries[parent if parent != -1 else index])
+        self.unindexed.append(index)
+        self.invalidate(index)
+
+    def rebuild_index(self):
+        entries = sorted((id_hash(self.get_id(index)), index) for index in range(len(self.parent)))
+        self.id_hashes = array("I", (entry[0] for entry in entries))
+        self.id_nodes = array("i", (entry[1] for entry in entries))
+        self.unindexed = array("i")
+
+    def lookup(self, node_id: str) -> list:
+        """
+        Indices of all nodes with node_id, in any order
+        """
+        if len(self.unindexed) > INDEX_BATCH:
+            self.rebuild_index()
+        node_hash = id_hash(node_id)
+        candidates = list(self.unindexed)
+        position = bisect_left(self.id_hashes, node_hash)
+        while position < len(self.id_hashes) and self.id_hashes[position] == node_hash:
+            candidates.append(self.id_nodes[position])
+            position += 1
+        return sorted(set(index for index in candidates if self.get_id(index) == node_id))
+
+    def children(self, index: int) -> list:
+        children = []
+        child = self.first_child[index]
+        while child != -1:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def append_child(self, index: int, child: int):
+        if self.parent[child] != -1:
+            raise ValueError(f"Node {self.get_id(child)} already has a parent")
+        self.parent[child] = index
+        if self.last_child[index] == -1:
+            self.first_child[index] = child
+        else:
+            self.next_sibling[self.last_child[index]] = child
+        self.last_child[index] = child
+        self.invalidate(index)
+
+    def detach_children(self, index: int):
+        child = self.first_child[index]
+        while child != -1:
+            next_child = self.next_sibling[child]
+            self.parent[child] = -1
+            self.next_sibling[child] = -1
+            child = next_child
+        self.first_child[index] = -1
+        self.last_child[index] = -1
+        self.invalidate(index)
+
+    def is_ancestor(self, ancestor: int, index: int) -> bool:
+        while index != -1:
+            if index == ancestor:
+                return True
+            index = self.parent[index]
+        return False
+
+    def find(self, node_id: str, root: int) -> int:
+        """
+        Index of the first node with node_id in the subtree of root, in pre-order, or -1
+        """
+        matches = [index for index in self.lookup(node_id) if self.is_ancestor(root, index)]
+        if len(matches) <= 1:
+            return matches[0] if matches else -1
+        # The id is used more than once in the subtree, return the one that comes first in the tree
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            if index in matches:
+                return index
+            stack += reversed(self.children(index))
+        return -1
+
+    def copy_subtree(self, other: "TreeStore", index: int) -> int:
+        """
+        Copy a subtree of another store into this one and return the index of its root
+        """
+        new_index = self.add_node(*(other.get_text(index, field) for field in range(FIELDS)))
+        for child in other.children(index):
+            self.append_child(new_index, self.copy_subtree(other, child))
+        return new_index
+
+    def invalidate(self, index: int):
+        """
+        Drop the rendered contexts of a node and its ancestors, whose renderings include the node
+        """
+        while index != -1:
+            self.context_cache.pop(index, None)
+            index = self.parent[index]
+
+    def compact(self):
+        """
+        Rewrite the text buffer without the space left behind by replaced texts
+        """
+        buffer = bytearray()
+        for offsets, lengths in ((self.text_offsets, self.text_lengths), (self.entry_offsets, self.entry_lengths)):
+            for slot in range(len(offsets)):
+                offset = offsets[slot]
+                offsets[slot] = len(buffer)
+                buffer += self.buffer[offset:offset + lengths[slot]]
+        self.buffer = buffer
+        self.garbage = 0
+
+    def memory_usage(self) -> int:
+        """
+        Approximate number of bytes used by the store, not counting the rendered context cache
+        """
+        arrays = (self.parent, self.first_child, self.last_child, self.next_sibling, self.text_offsets, self.text_lengths,
+                  self.id_entries, self.entry_prefixes, self.entry_offsets, self.entry_lengths, self.id_hashes, self.id_nodes)
+        return sum(sys.getsizeof(values) for values in arrays + (self.unindexed,)) + sys.getsizeof(self.buffer)
+
+def id_hash(node_id: str) -> int:
+    # 32 bits are enough to narrow a lookup down, the ids of the candidates are compared
+    return hash(node_id) & 0xFFFFFFFF